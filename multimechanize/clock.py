@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+#
+#  Copyright (c) 2010-2012 Corey Goldberg (corey@goldb.org)
+#  License: GNU LGPLv3
+#
+#  This file is part of Multi-Mechanize | Performance Test Framework
+#
+
+"""
+monotonic, high resolution clock used to time transactions.
+
+durations are measured with a monotonic clock in integer nanoseconds, so
+they are not affected by NTP adjustments of the system time.  wall clock
+times are derived from a single anchor taken when a Clock is created.
+"""
+
+import ctypes
+import ctypes.util
+import sys
+import time
+
+
+# clock id of CLOCK_MONOTONIC for clock_gettime(), by platform
+CLOCK_MONOTONIC_IDS = {
+    'linux': 1,
+    'darwin': 6,
+    'freebsd': 4,
+}
+
+
+
+class _timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+
+def _clock_gettime_source():
+    platform = sys.platform.rstrip('0123456789')
+    clock_id = CLOCK_MONOTONIC_IDS.get(platform)
+    if clock_id is None:
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        clock_gettime = libc.clock_gettime
+    except (OSError, AttributeError):
+        return None
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_timespec)]
+    ts = _timespec()
+    if clock_gettime(clock_id, ctypes.byref(ts)) != 0:
+        return None
+
+    def monotonic_ns():
+        clock_gettime(clock_id, ctypes.byref(ts))
+        return ts.tv_sec * 1000000000 + ts.tv_nsec
+    return monotonic_ns
+
+
+
+def _performance_counter_source():
+    try:
+        kernel32 = ctypes.windll.kernel32
+    except AttributeError:
+        return None
+    frequency = ctypes.c_int64()
+    counter = ctypes.c_int64()
+    if not kernel32.QueryPerformanceFrequency(ctypes.byref(frequency)):
+        return None
+    frequency = frequency.value
+
+    def monotonic_ns():
+        kernel32.QueryPerformanceCounter(ctypes.byref(counter))
+        return counter.value * 1000000000 // frequency
+    return monotonic_ns
+
+
+
+def _time_source():
+    if hasattr(time, 'monotonic_ns'):  # python 3.7+
+        return time.monotonic_ns
+
+    def monotonic_ns():
+        return int(time.time() * 1000000000)
+    return monotonic_ns
+
+
+
+def _find_source():
+    if sys.platform.startswith('win'):
+        source = _performance_counter_source()
+    else:
+        source = _clock_gettime_source()
+    if source is None:
+        source = _time_source()
+    return source
+
+
+monotonic_ns = _find_source()
+
+
+
+class Clock(object):
+    """
+    a monotonic clock anchored to the wall clock once, at creation.  create
+    one per process; all epoch times it derives move in step with the
+    monotonic clock even if the system time is stepped during the run.
+    """
+
+    def __init__(self):
+        self.now = monotonic_ns
+        self.anchor_ns = monotonic_ns()
+        self.anchor_epoch_ns = int(time.time() * 1000000000)
+
+    def epoch_ns(self, mono_ns):
+        """wall clock time (nanoseconds since the epoch) of a monotonic time."""
+        return self.anchor_epoch_ns + (mono_ns - self.anchor_ns)
+
+    def from_epoch(self, epoch_secs):
+        """monotonic time of a wall clock time given in seconds since the epoch."""
+        return self.anchor_ns + int((epoch_secs * 1000000000) - self.anchor_epoch_ns)
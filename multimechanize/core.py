@@ -8,12 +8,18 @@
 #
 
 
+import Queue
+import collections
+import itertools
 import multiprocessing
 import os
+import random
 import sys
 import threading
 import time
+import zlib
 
+from multimechanize.clock import Clock, monotonic_ns
 from multimechanize.script_loader import ScriptLoader
 from multimechanize.script_loader import GeneratorValidator
 import os.path
@@ -51,19 +57,165 @@ class GeneratorWrapper(threading.Thread):
     """
 
     class GeneratorClient(object):
-        def __init__(self, uri):
+        """
+        with a batch_size above 1, next() values are fetched batch_size at a
+        time into a buffer shared by the threads of a process, and the
+        buffer is refilled by a background thread once it is half empty.
+        every value is still handed out once; values are consumed in
+        generator order within a process, but processes consume their
+        batches side by side.
+
+        with a cache_size above 0, get() results are kept in a per-process
+        LRUCache.  hits and misses are counted per process and added to
+        the shared cache_hits / cache_misses counters by flush_stats().
+
+        uri may be a list of the uris of several shards of a generator:
+        get() calls go to the shard picked by a hash of the key, next()
+        calls to the first shard.
+        """
+        def __init__(self, uri, batch_size=1, cache_size=0, cache_ttl=None, cache_hits=None, cache_misses=None):
             self.uri = uri
-            self.proxy = Pyro4.Proxy(uri)
+            uris = uri
+            if not isinstance(uris, (list, tuple)):
+                uris = [uri]
+            self.proxies = [Pyro4.Proxy(shard_uri) for shard_uri in uris]
+            self.proxy = self.proxies[0]
+            self.batch_size = batch_size
+            self.background_refill = True
+            self.buffer = collections.deque()
+            self.condition = threading.Condition()
+            self.refilling = False
+            self.refill_error = None  # sys.exc_info() of what the last background refill raised
+            self.exhausted = False
+            self.cache_size = cache_size
+            self.cache_ttl = cache_ttl
+            self.cache = None
+            if cache_size > 0:
+                self.cache = LRUCache(cache_size, cache_ttl)
+            self.cache_lock = threading.Lock()
+            if cache_hits is None:
+                cache_hits = multiprocessing.Value('l', 0)
+                cache_misses = multiprocessing.Value('l', 0)
+            self.cache_hits = cache_hits
+            self.cache_misses = cache_misses
+            self.hit_count = 0
+            self.miss_count = 0
+        def __getstate__(self):
+            return self.uri, self.batch_size, self.cache_size, self.cache_ttl, self.cache_hits, self.cache_misses
+        def __setstate__(self, state):
+            self.__init__(*state)
         def next(self):
-            return self.proxy.next()
+            if self.batch_size <= 1:
+                return self.proxy.next()
+            with self.condition:
+                while not self.buffer:
+                    if self.exhausted:
+                        raise StopIteration
+                    if self.refill_error is not None:
+                        # fail this call; the next one fetches again
+                        exc_type, exc_value, exc_tb = self.refill_error
+                        self.refill_error = None
+                        raise exc_type, exc_value, exc_tb
+                    if self.refilling:
+                        self.condition.wait()
+                    else:
+                        self.refill()
+                value = self.buffer.popleft()
+                if (self.background_refill and not self.refilling and not self.exhausted and
+                        len(self.buffer) <= self.batch_size // 2):
+                    self.refilling = True
+                    refill_thread = threading.Thread(target=self.refill_in_background)
+                    refill_thread.daemon = True
+                    refill_thread.start()
+                return value
+        def refill(self):
+            values = self.proxy.next_batch(self.batch_size)
+            if not values:
+                self.exhausted = True
+            self.buffer.extend(values)
+        def refill_in_background(self):
+            try:
+                values = self.proxy.next_batch(self.batch_size)
+            except Exception:
+                with self.condition:
+                    # raised, with its traceback, by next() once the buffer runs empty
+                    self.refill_error = sys.exc_info()
+                    self.refilling = False
+                    self.condition.notify_all()
+                return
+            with self.condition:
+                if not values:
+                    self.exhausted = True
+                self.refill_error = None
+                self.buffer.extend(values)
+                self.refilling = False
+                self.condition.notify_all()
+        def shard(self, key):
+            if len(self.proxies) == 1:
+                return self.proxy
+            return self.proxies[zlib.crc32(repr(key)) % len(self.proxies)]
+        def fetch_many(self, keys):
+            if len(self.proxies) == 1:
+                return self.proxy.get_many(keys)
+            shard_keys = {}  # {shard: [(position, key)]}
+            for i, key in enumerate(keys):
+                shard_keys.setdefault(self.shard(key), []).append((i, key))
+            values = [None] * len(keys)
+            for proxy, positions in shard_keys.iteritems():
+                for (i, key), value in zip(positions, proxy.get_many([key for i, key in positions])):
+                    values[i] = value
+            return values
         def get(self, key):
-            return self.proxy.get(key)
+            if self.cache is None:
+                return self.shard(key).get(key)
+            with self.cache_lock:
+                found, value = self.cache.get(key)
+                if found:
+                    self.hit_count += 1
+                    return value
+                self.miss_count += 1
+            value = self.shard(key).get(key)
+            with self.cache_lock:
+                self.cache.put(key, value)
+            return value
+        def get_many(self, keys):
+            """get() of several keys, fetching all the ones that are not cached in one call."""
+            if self.cache is None:
+                return self.fetch_many(list(keys))
+            values = []
+            missing = []
+            with self.cache_lock:
+                for key in keys:
+                    found, value = self.cache.get(key)
+                    values.append(value)
+                    if not found:
+                        missing.append((len(values) - 1, key))
+                self.hit_count += len(values) - len(missing)
+                self.miss_count += len(missing)
+            if missing:
+                fetched = self.fetch_many([key for i, key in missing])
+                with self.cache_lock:
+                    for (i, key), value in zip(missing, fetched):
+                        values[i] = value
+                        self.cache.put(key, value)
+            return values
+        def flush_stats(self):
+            """add the cache hits and misses of this process to the shared counters."""
+            with self.cache_lock:
+                hit_count, miss_count = self.hit_count, self.miss_count
+                self.hit_count = self.miss_count = 0
+            with self.cache_hits.get_lock():
+                self.cache_hits.value += hit_count
+            with self.cache_misses.get_lock():
+                self.cache_misses.value += miss_count
 
     class GeneratorProxy:
         def __init__(self, obj):
             self._obj = obj
             self.lock = threading.Lock()
-            self._gen = obj.next()
+            self._gen = None
+            if hasattr(obj, 'next'):  # key/value generators may only have get()
+                self._gen = obj.next()
         def next(self):
             self.lock.acquire()
             try:
@@ -71,10 +223,21 @@ class GeneratorWrapper(threading.Thread):
             finally:
                 self.lock.release()
 
+        def next_batch(self, n):
+            """up to n next() values; fewer (or none) once the generator is exhausted."""
+            self.lock.acquire()
+            try:
+                return list(itertools.islice(self._gen, n))
+            finally:
+                self.lock.release()
+
         def get(self, key):
             return self._obj.get(key)
 
-    def __init__(self, script_file):
+        def get_many(self, keys):
+            return [self._obj.get(key) for key in keys]
+
+    def __init__(self, script_file, batch_size=1, cache_size=0, cache_ttl=None):
         """
         """
         threading.Thread.__init__(self)
@@ -85,7 +248,7 @@ class GeneratorWrapper(threading.Thread):
         self.daemon_object = Pyro4.Daemon()
         self.genproxy = GeneratorWrapper.GeneratorProxy(getattr(self.module, "Generator")())
         uri = self.daemon_object.register(self.genproxy)
-        self.client = GeneratorWrapper.GeneratorClient(uri)
+        self.client = GeneratorWrapper.GeneratorClient(uri, batch_size, cache_size, cache_ttl)
 
     def get_client(self):
         return self.client
@@ -99,9 +262,196 @@ class GeneratorWrapper(threading.Thread):
 
 
 
+class GeneratorService(object):
+    """
+    runs a generator script in processes of its own, so serving it does not
+    compete with the results writer for the controller process.  each
+    process answers requests from a pool of threads.  with several shards,
+    every shard process has its own instance of the generator and get()
+    requests are spread over them by key hash; next() is served by the
+    first shard only, so its values stay unique and in order.
+    """
+
+    START_TIMEOUT = 60
+
+    def __init__(self, script_file, batch_size=1, cache_size=0, cache_ttl=None, threads=None, shards=1):
+        module = load_script(script_file)
+        GeneratorValidator.ensure_module_valid(module)
+        self.script_file = script_file
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.threads = threads
+        self.uri_queue = multiprocessing.Queue()
+        self.processes = []
+        for shard in range(shards):
+            process = multiprocessing.Process(target=serve_generator,
+                                              args=(script_file, threads, shard, self.uri_queue))
+            process.daemon = True
+            self.processes.append(process)
+        self.client = None
+
+    def start(self):
+        for process in self.processes:
+            process.start()
+        uris = [None] * len(self.processes)
+        for i in range(len(self.processes)):
+            try:
+                shard, uri = self.uri_queue.get(True, self.START_TIMEOUT)
+            except Queue.Empty:
+                raise RuntimeError('generator %s did not start' % self.script_file)
+            uris[shard] = uri
+        if len(uris) == 1:
+            uris = uris[0]
+        self.client = GeneratorWrapper.GeneratorClient(uris, self.batch_size, self.cache_size, self.cache_ttl)
+
+    def get_client(self):
+        return self.client
+
+    def terminate(self):
+        for process in self.processes:
+            if process.is_alive():
+                process.terminate()
+
+
+
+def serve_generator(script_file, threads, shard, uri_queue):
+    """main function of a GeneratorService process."""
+    if threads:
+        Pyro4.config.THREADPOOL_SIZE = threads
+    module = load_script(script_file)
+    daemon = Pyro4.Daemon()
+    uri = daemon.register(GeneratorWrapper.GeneratorProxy(getattr(module, "Generator")()))
+    uri_queue.put((shard, str(uri)))
+    daemon.requestLoop()
+
+
+
+class LRUCache(object):
+    """
+    dict with a size limit: once full, the least recently used key is
+    evicted.  with a ttl (secs), keys also expire that long after they
+    were stored.  not thread safe.
+
+    keys are kept in a circular doubly linked list of [prev, next, key,
+    value, expiry] links, most recently used last (collections.OrderedDict
+    needs python 2.7).
+    """
+
+    def __init__(self, size, ttl=None):
+        self.size = size
+        self.ttl_ns = None
+        if ttl:
+            self.ttl_ns = int(ttl * 1000000000)
+        self.links = {}  # {key: link}
+        self.root = []
+        self.root[:] = [self.root, self.root, None, None, None]
+
+    def unlink(self, link):
+        link_prev, link_next = link[0], link[1]
+        link_prev[1] = link_next
+        link_next[0] = link_prev
+
+    def append(self, link):
+        last = self.root[0]
+        link[0], link[1] = last, self.root
+        last[1] = self.root[0] = link
+
+    def get(self, key):
+        """:returns: (found, value)"""
+        link = self.links.get(key)
+        if link is None:
+            return False, None
+        expiry = link[4]
+        if expiry is not None and monotonic_ns() >= expiry:
+            self.unlink(link)
+            del self.links[key]
+            return False, None
+        self.unlink(link)
+        self.append(link)
+        return True, link[3]
+
+    def put(self, key, value):
+        expiry = None
+        if self.ttl_ns is not None:
+            expiry = monotonic_ns() + self.ttl_ns
+        link = self.links.get(key)
+        if link is not None:
+            self.unlink(link)
+        link = self.links[key] = [None, None, key, value, expiry]
+        self.append(link)
+        if len(self.links) > self.size:
+            oldest = self.root[1]
+            self.unlink(oldest)
+            del self.links[oldest[2]]
+
+
+
+class ResultBuffer(object):
+    """
+    collects result records from all agents of a user group process and puts
+    them on the shared results queue in batches, instead of paying a pickle
+    and pipe write for every single transaction.  a batch is flushed once it
+    holds batch_size records or its oldest record is older than
+    batch_interval seconds.
+    """
+
+    def __init__(self, queue, batch_size=100, batch_interval=0.5):
+        self.queue = queue
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.lock = threading.Lock()
+        self.records = []
+        self.first_record_time = None
+
+    def append(self, fields):
+        self.lock.acquire()
+        try:
+            if not self.records:
+                self.first_record_time = time.time()
+            self.records.append(fields)
+            if len(self.records) < self.batch_size and \
+                    time.time() - self.first_record_time < self.batch_interval:
+                return
+            batch = self._take()
+        finally:
+            self.lock.release()
+        self.queue.put(batch)
+
+    def flush_expired(self):
+        """flush the pending batch if it is older than batch_interval."""
+        self.lock.acquire()
+        try:
+            if not self.records or \
+                    time.time() - self.first_record_time < self.batch_interval:
+                return
+            batch = self._take()
+        finally:
+            self.lock.release()
+        self.queue.put(batch)
+
+    def flush(self):
+        self.lock.acquire()
+        try:
+            batch = self._take()
+        finally:
+            self.lock.release()
+        if batch:
+            self.queue.put(batch)
+
+    def _take(self):
+        batch = self.records
+        self.records = []
+        self.first_record_time = None
+        return batch
+
+
+
 class UserGroup(multiprocessing.Process):
     def __init__(self, queue, process_num, user_group_name, num_threads,
-                 script_file, run_time, rampup, generator_client, user_group_global_config):
+                 script_file, run_time, rampup, generator_client, user_group_global_config,
+                 results_batch_size=100, results_batch_interval=0.5, agent_type='thread',
+                 rate=None, arrival='fixed', thread_offset=0, cpu=None, arrival_offset=0.0):
         multiprocessing.Process.__init__(self)
         self.queue = queue
         self.process_num = process_num
@@ -113,32 +463,211 @@ class UserGroup(multiprocessing.Process):
         self.start_time = time.time()
         self.generator_client = generator_client
         self.user_group_global_config = user_group_global_config
+        self.results_batch_size = results_batch_size
+        self.results_batch_interval = results_batch_interval
+        self.agent_type = agent_type
+        self.rate = rate
+        self.arrival = arrival
+        self.thread_offset = thread_offset
+        self.cpu = cpu
+        self.arrival_offset = arrival_offset
+        # filled in by the user group process when it runs on an arrival schedule
+        self.scheduled_count = multiprocessing.Value('l', 0)
+        self.late_count = multiprocessing.Value('l', 0)
+        self.missed_count = multiprocessing.Value('l', 0)
 
     def run(self):
+        if self.cpu is not None:
+            self.set_cpu_affinity()
+        if self.agent_type == 'greenlet':
+            # make sockets and sleeps of the scripts cooperative before they
+            # are imported.  real threads are left alone, the results queue
+            # relies on its feeder thread.
+            from gevent import monkey
+            monkey.patch_all(thread=False)
         # -- ENSURE: (Re-)Import script_module in forked Process
         script_module = load_script(self.script_file)
+        result_buffer = ResultBuffer(self.queue, self.results_batch_size,
+                                     self.results_batch_interval)
+        self.clock = Clock()
+        self.schedule = None
+        if self.rate:
+            self.schedule = ArrivalSchedule(self.rate, self.arrival,
+                                            self.clock.from_epoch(self.start_time), self.run_time,
+                                            self.arrival_offset)
+        if self.agent_type == 'greenlet':
+            self.run_greenlets(script_module, result_buffer)
+        else:
+            self.run_threads(script_module, result_buffer)
+        result_buffer.flush()
+        if hasattr(self.generator_client, 'flush_stats'):
+            self.generator_client.flush_stats()
+        if self.schedule is not None:
+            self.schedule.finish()
+            self.scheduled_count.value = self.schedule.count
+            self.late_count.value = self.schedule.late_count
+            self.missed_count.value = self.schedule.missed_count
+
+    def set_cpu_affinity(self):
+        """pin this process to one cpu core."""
+        try:
+            os.sched_setaffinity(0, [self.cpu])
+            return
+        except AttributeError:  # before python 3.3
+            pass
+        try:
+            import psutil
+            psutil.Process(os.getpid()).cpu_affinity([self.cpu])
+        except (ImportError, AttributeError):
+            sys.stderr.write('WARNING: can not set cpu affinity of %s, install psutil\n' % self.user_group_name)
+
+    def create_agent(self, thread_num, script_module, result_buffer, generator_client):
+        if hasattr(generator_client, 'cursor'):  # data feeders give every agent its own cursor
+            generator_client = generator_client.cursor(self.user_group_name, self.thread_offset + thread_num)
+        return Agent(result_buffer, self.process_num, self.thread_offset + thread_num,
+                     self.start_time, self.run_time,
+                     self.user_group_name,
+                     script_module, self.script_file, generator_client, self.user_group_global_config,
+                     self.clock, self.schedule)
+
+    def spacing(self):
+        """delay between starting two agents."""
+        if self.schedule is not None:
+            # the arrival schedule sets the pace, the worker pool is started at once
+            return 0.0
+        return float(self.rampup) / float(self.num_threads)
+
+    def run_threads(self, script_module, result_buffer):
         threads = []
+        spacing = self.spacing()
         for i in range(self.num_threads):
-            spacing = float(self.rampup) / float(self.num_threads)
             if i > 0:
                 time.sleep(spacing)
-            agent_thread = Agent(self.queue, self.process_num, i,
-                                 self.start_time, self.run_time,
-                                 self.user_group_name,
-                                 script_module, self.script_file, self.generator_client, self.user_group_global_config)
+            agent_thread = self.create_agent(i, script_module, result_buffer, self.generator_client)
             agent_thread.daemon = True
             threads.append(agent_thread)
             agent_thread.start()
+        # the main thread is idle from here on, so it takes care of sending
+        # batches that filled up too slowly to be flushed by the agents.
         for agent_thread in threads:
-            agent_thread.join()
+            while agent_thread.is_alive():
+                agent_thread.join(self.results_batch_interval)
+                result_buffer.flush_expired()
+
+    def run_greenlets(self, script_module, result_buffer):
+        """
+        run every virtual user as a greenlet on the event loop of this
+        process instead of as an OS thread.
+        """
+        import gevent
+        generator_client = self.generator_client
+        if generator_client is not None and not hasattr(generator_client, 'cursor'):
+            generator_client = CooperativeGeneratorClient(generator_client)
+        greenlets = []
+        spacing = self.spacing()
+        for i in range(self.num_threads):
+            if i > 0:
+                gevent.sleep(spacing)
+                result_buffer.flush_expired()
+            agent = self.create_agent(i, script_module, result_buffer, generator_client)
+            greenlets.append(gevent.spawn(agent.run))
+        while [g for g in greenlets if not g.ready()]:
+            gevent.joinall(greenlets, timeout=self.results_batch_interval)
+            result_buffer.flush_expired()
+
+
+
+class ArrivalSchedule(object):
+    """
+    open workload model: hands out the intended start times (monotonic clock
+    nanoseconds) of transactions at a target rate, either evenly spaced
+    ('fixed') or with exponentially distributed gaps ('poisson').  the agents
+    of a user group act as the worker pool; an agent that picks up a start
+    time which has already passed by more than tolerance ns counts it as late.
+    the first transaction starts offset secs after start_ns.
+    """
+
+    tolerance = 10000000
+
+    def __init__(self, rate, arrival, start_ns, run_time, offset=0.0):
+        self.rate = float(rate)
+        self.arrival = arrival
+        self.end_time = start_ns + int(run_time * 1000000000)
+        self.next_time = start_ns + int(offset * 1000000000)
+        self.random = random.Random()
+        self.lock = threading.Lock()
+        self.count = 0
+        self.late_count = 0
+        self.missed_count = 0
+
+    def next(self):
+        """
+        :returns: intended start time of the next transaction.
+        :returns: None, once the schedule reaches the end of the run.
+        """
+        self.lock.acquire()
+        try:
+            intended = self.next_time
+            if intended >= self.end_time:
+                return None
+            if self.arrival == 'poisson':
+                self.next_time += int(self.random.expovariate(self.rate) * 1000000000)
+            else:
+                self.next_time += int(1000000000 / self.rate)
+            self.count += 1
+            return intended
+        finally:
+            self.lock.release()
+
+    def finish(self):
+        """count the start times no agent got to before the end of the run."""
+        while self.next() is not None:
+            self.missed_count += 1
+
+    def mark_late(self):
+        self.lock.acquire()
+        try:
+            self.late_count += 1
+        finally:
+            self.lock.release()
+
+
+
+class CooperativeGeneratorClient(object):
+    """
+    serializes the generator calls of greenlet agents.  all greenlets of a
+    process share one thread, so the Pyro proxy's own thread lock does not
+    keep them from interleaving requests on its connection.
+    """
+
+    def __init__(self, client):
+        from gevent.lock import Semaphore
+        self.client = client
+        self.lock = Semaphore()
+        # the Pyro socket is cooperative now, it must not be used from an
+        # OS thread
+        client.background_refill = False
+
+    def next(self):
+        with self.lock:
+            return self.client.next()
+
+    def get(self, key):
+        with self.lock:
+            return self.client.get(key)
+
+    def get_many(self, keys):
+        with self.lock:
+            return self.client.get_many(keys)
 
 
 
 class Agent(threading.Thread):
-    def __init__(self, queue, process_num, thread_num, start_time, run_time,
-                 user_group_name, script_module, script_file, generator_client, user_group_global_config):
+    def __init__(self, result_buffer, process_num, thread_num, start_time, run_time,
+                 user_group_name, script_module, script_file, generator_client, user_group_global_config,
+                 clock=None, schedule=None):
         threading.Thread.__init__(self)
-        self.queue = queue
+        self.result_buffer = result_buffer
         self.process_num = process_num
         self.thread_num = thread_num
         self.start_time = start_time
@@ -148,14 +677,8 @@ class Agent(threading.Thread):
         self.script_file   = script_file
         self.generator_client = generator_client
         self.user_group_global_config = user_group_global_config
-
-        # choose most accurate timer to use (time.clock has finer granularity
-        # than time.time on windows, but shouldn't be used on other systems).
-        if sys.platform.startswith('win'):
-            self.default_timer = time.clock
-        else:
-            self.default_timer = time.time
-
+        self.clock = clock or Clock()
+        self.schedule = schedule
 
     def run(self):
         elapsed = 0
@@ -167,21 +690,43 @@ class Agent(threading.Thread):
         trans.process_num = self.process_num
         trans.user_group_global_config = self.user_group_global_config
 
-        while elapsed < self.run_time:
+        now = self.clock.now
+        epoch_ns = self.clock.epoch_ns
+        schedule = self.schedule
+        append = self.result_buffer.append
+        user_group_name = self.user_group_name
+        start_time = self.start_time
+        run_time = self.run_time
+
+        while elapsed < run_time:
             error = ''
-            start = self.default_timer()
+            if schedule is None:
+                start = now()
+            else:
+                # measure from the intended start, so time spent waiting for
+                # a free agent counts against the response time
+                start = schedule.next()
+                if start is None:
+                    break
+                lag = now() - start
+                if lag < 0:
+                    time.sleep(-lag / 1e9)
+                elif lag > schedule.tolerance:
+                    schedule.mark_late()
 
             try:
                 trans.run()
             except Exception, e:  # test runner catches all script exceptions here
                 error = str(e).replace(',', '')
 
-            finish = self.default_timer()
-
-            scriptrun_time = finish - start
-            elapsed = time.time() - self.start_time
+            finish = now()
 
-            epoch = time.mktime(time.localtime())
+            scriptrun_time = (finish - start) / 1e9
+            start_ns = epoch_ns(start)
+            finish_ns = epoch_ns(finish)
+            elapsed = finish_ns / 1e9 - start_time
+            epoch = finish_ns // 1000000000
 
-            fields = (elapsed, epoch, self.user_group_name, scriptrun_time, error, trans.custom_timers)
-            self.queue.put(fields)
+            # copy the timers, the record may sit in the result buffer while
+            # the script keeps updating its custom_timers dict
+            append((elapsed, epoch, user_group_name, scriptrun_time, error, trans.custom_timers.copy(), start_ns, finish_ns))
@@ -28,6 +28,13 @@ except ImportError:
     print 'can not import Mechanize'
 
 
+try:
+    import numpy
+    print 'imported NumPy succesfully'
+except ImportError:
+    print 'can not import NumPy'
+
+
 try:
     import pylab
     print 'imported Matplotlib succesfully'
@@ -46,3 +53,15 @@ try:
     print 'imported Pyro4 successfully'
 except ImportError:
     print 'can not import Pyro4'
+
+try:
+    import gevent
+    print 'imported gevent successfully'
+except ImportError:
+    print 'can not import gevent'
+
+try:
+    import psutil
+    print 'imported psutil successfully'
+except ImportError:
+    print 'can not import psutil'
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+#
+#  Copyright (c) 2010-2012 Corey Goldberg (corey@goldb.org)
+#  License: GNU LGPLv3
+#
+#  This file is part of Multi-Mechanize | Performance Test Framework
+#
+
+"""
+data feeders: generators that hand out the lines of a data file without a
+generator service.  the file is indexed once, in the controller process,
+into a sidecar file (<data file>.idx, 8 bytes per line, reused while the
+data file is unchanged).  both are memory-mapped by every user group
+process, so neither the file nor its index needs to fit in RAM, and no
+value needs a Pyro call.
+
+every virtual user gets its own cursor over the lines:
+
+  sequential  user k of n reads lines k, k + n, k + 2n, ... and starts
+              over at the end of the file.
+  unique      like sequential, but every line is used once; next() raises
+              StopIteration when a user has run out of lines.
+  random      a random line on every call.
+"""
+
+import csv
+import mmap
+import os
+import random
+import struct
+import tempfile
+import threading
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+MODES = ('sequential', 'random', 'unique')
+FORMATS = ('lines', 'csv')
+INDEX_BLOCK_SIZE = 16 * 1024 * 1024
+
+# index file: header (magic, header line skipped, size and mtime of the
+# data file), then the offset of the start of every line as a little-endian
+# 64 bit integer
+INDEX_MAGIC = 'MMFI\x01'
+INDEX_HEADER = struct.Struct('<5sBQd')
+OFFSET = struct.Struct('<q')
+
+
+
+def index_header(file_name, skip_header):
+    stat = os.stat(file_name)
+    return INDEX_HEADER.pack(INDEX_MAGIC, bool(skip_header), stat.st_size, stat.st_mtime)
+
+
+
+def line_starts(data, block_start, block_end, size):
+    """:returns: starts of the lines beginning after a newline in data[block_start:block_end]."""
+    if numpy is not None:
+        block = numpy.frombuffer(data[block_start:block_end], dtype=numpy.uint8)
+        starts = numpy.flatnonzero(block == 10) + (block_start + 1)
+        return starts[starts < size].astype('<i8').tostring()
+    starts = []
+    position = data.find('\n', block_start, block_end)
+    while position != -1 and position + 1 < size:
+        starts.append(position + 1)
+        position = data.find('\n', position + 1, block_end)
+    return struct.pack('<%dq' % len(starts), *starts)
+
+
+
+def write_index(file_name, index_file_name, skip_header=False):
+    """write the line index of a file, one block of the file at a time."""
+    size = os.path.getsize(file_name)
+    with open(index_file_name, 'wb') as index:
+        index.write(index_header(file_name, skip_header))
+        if size == 0:
+            return
+        with open(file_name, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                if not skip_header:
+                    index.write(OFFSET.pack(0))
+                for block_start in xrange(0, size, INDEX_BLOCK_SIZE):
+                    index.write(line_starts(data, block_start, min(block_start + INDEX_BLOCK_SIZE, size), size))
+            finally:
+                data.close()
+
+
+
+def index_lines(file_name, skip_header=False):
+    """
+    index the lines of a file into <file name>.idx, unless it already holds
+    the index of the file as it is now.  where that can not be written, the
+    index goes to a temporary file.
+    :returns: (index file name, number of lines, whether it is temporary)
+    """
+    index_file_name = file_name + '.idx'
+    header = index_header(file_name, skip_header)
+    try:
+        with open(index_file_name, 'rb') as f:
+            valid = f.read(INDEX_HEADER.size) == header
+    except IOError:
+        valid = False
+    temporary = False
+    if not valid:
+        try:
+            write_index(file_name, index_file_name, skip_header)
+        except (IOError, OSError):
+            fd, index_file_name = tempfile.mkstemp(suffix='.idx')
+            os.close(fd)
+            temporary = True
+            write_index(file_name, index_file_name, skip_header)
+    line_count = (os.path.getsize(index_file_name) - INDEX_HEADER.size) // OFFSET.size
+    return index_file_name, line_count, temporary
+
+
+
+class LineIndex(object):
+    """read-only sequence of the line offsets in a memory-mapped index file."""
+
+    def __init__(self, index_file_name):
+        with open(index_file_name, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.count = (len(self.data) - INDEX_HEADER.size) // OFFSET.size
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError('line index out of range')
+        return OFFSET.unpack_from(self.data, INDEX_HEADER.size + i * OFFSET.size)[0]
+
+
+
+class DataFeeder(object):
+    """
+    a data file used like a generator script in the [generators] section.
+    consumers (virtual users) are registered per user group before the
+    user groups start, so every one of them gets its own cursor.
+    """
+
+    def __init__(self, file_name, mode='sequential', format='lines', header=False):
+        if mode not in MODES:
+            raise AttributeError("unknown feeder mode %s (use %s)" % (mode, ', '.join(MODES)))
+        if format not in FORMATS:
+            raise AttributeError("unknown feeder format %s (use %s)" % (format, ', '.join(FORMATS)))
+        self.file_name = file_name
+        self.mode = mode
+        self.format = format
+        self.index_file_name, self.line_count, self.temporary_index = index_lines(file_name, header)
+        self.group_offsets = {}  # {user group name: index of its first consumer}
+        self.consumer_count = 0
+        self.client = FeederClient(self)
+
+    def add_consumers(self, user_group_name, num_threads):
+        self.group_offsets[user_group_name] = self.consumer_count
+        self.consumer_count += num_threads
+
+    def get_client(self):
+        return self.client
+
+    def start(self):
+        pass
+
+    def terminate(self):
+        if self.temporary_index and os.path.exists(self.index_file_name):
+            os.remove(self.index_file_name)
+
+
+
+class FeederClient(object):
+    """the per-process side of a DataFeeder; the file and its index are mapped on first use."""
+
+    def __init__(self, feeder):
+        self.feeder = feeder
+        self.data = None
+        self.index = None
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        return self.feeder
+
+    def __setstate__(self, feeder):
+        self.__init__(feeder)
+
+    def cursor(self, user_group_name, thread_num):
+        consumer = self.feeder.group_offsets.get(user_group_name, 0) + thread_num
+        return FeederCursor(self, consumer, max(self.feeder.consumer_count, consumer + 1))
+
+    def line(self, i):
+        if self.data is None:
+            with self.lock:
+                if self.data is None:
+                    self.index = LineIndex(self.feeder.index_file_name)
+                    with open(self.feeder.file_name, 'rb') as f:
+                        self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        start = self.index[i]
+        end = self.data.find('\n', start)
+        if end == -1:
+            end = len(self.data)
+        line = self.data[start:end].rstrip('\r')
+        if self.feeder.format == 'csv':
+            return csv.reader([line]).next()
+        return line
+
+    def get(self, i):
+        """line i of the file."""
+        return self.line(i)
+
+
+
+class FeederCursor(object):
+    """what a virtual user sees as its generator."""
+
+    def __init__(self, client, consumer, consumer_count):
+        self.client = client
+        self.mode = client.feeder.mode
+        self.line_count = client.feeder.line_count
+        self.position = consumer
+        self.step = consumer_count
+        self.random = random.Random(consumer)
+
+    def next(self):
+        if self.line_count == 0:
+            raise StopIteration
+        if self.mode == 'random':
+            return self.client.line(self.random.randrange(self.line_count))
+        if self.position >= self.line_count:
+            if self.mode == 'unique':
+                raise StopIteration('no unique lines left in %s' % os.path.basename(self.client.feeder.file_name))
+            self.position %= self.line_count
+        line = self.client.line(self.position)
+        self.position += self.step
+        return line
+
+    def get(self, i):
+        return self.client.get(i)
@@ -7,19 +7,39 @@
 #
 
 
+import multiprocessing
 import sys
+import time
+import traceback
 
 try:
     import matplotlib
     matplotlib.use('Agg')  # use a non-GUI backend
+    from matplotlib.colors import LogNorm
     from pylab import *
+    import numpy
 except ImportError:
     print 'ERROR: can not import Matplotlib. install Matplotlib to generate graphs'
 
 
+# raw response time graphs plot every point up to SCATTER_MAX_POINTS,
+# a per time bucket envelope up to ENVELOPE_MAX_POINTS and a density map
+# beyond.  the OUTLIER_POINTS slowest points are always plotted.
+SCATTER_MAX_POINTS = 20000
+ENVELOPE_MAX_POINTS = 500000
+ENVELOPE_BUCKETS = 400
+DENSITY_BINS = (400, 150)
+OUTLIER_POINTS = 500
+
+
 
 # response time graph for raw data
 def resp_graph_raw(nested_resp_list, image_name, dir='./'):
+    """
+    nested_resp_list: (elapsed, response time) points, a list of pairs or an
+    (n, 2) array.
+    :returns: description of what the graph shows, for the report heading.
+    """
     fig = figure(figsize=(8, 3.3))  # image dimensions
     ax = fig.add_subplot(111)
     ax.set_xlabel('Elapsed Time In Test (secs)', size='x-small')
@@ -27,13 +47,74 @@ def resp_graph_raw(nested_resp_list, image_name, dir='./'):
     ax.grid(True, color='#666666')
     xticks(size='x-small')
     yticks(size='x-small')
-    x_seq = [item[0] for item in nested_resp_list]
-    y_seq = [item[1] for item in nested_resp_list]
-    ax.plot(x_seq, y_seq,
-        color='blue', linestyle='-', linewidth=0.0, marker='o',
-        markeredgecolor='blue', markerfacecolor='blue', markersize=2.0)
+    points = numpy.asarray(nested_resp_list, dtype=numpy.float64).reshape(-1, 2)
+    x_seq, y_seq = points[:, 0], points[:, 1]
+    count = len(points)
+    description = raw_graph_description(count)
+    if count <= SCATTER_MAX_POINTS:
+        ax.plot(x_seq, y_seq,
+            color='blue', linestyle='-', linewidth=0.0, marker='o',
+            markeredgecolor='blue', markerfacecolor='blue', markersize=2.0)
+    else:
+        if count <= ENVELOPE_MAX_POINTS:
+            plot_envelope(ax, x_seq, y_seq)
+        else:
+            plot_density(ax, x_seq, y_seq)
+        plot_outliers(ax, x_seq, y_seq)
     ax.plot([0.0,], [0.0,], linewidth=0.0, markersize=0.0)
-    savefig(dir + image_name)
+    fig.savefig(dir + image_name)
+    close(fig)
+    return description
+
+
+
+def raw_graph_description(count):
+    """what resp_graph_raw() shows for count points."""
+    if count <= SCATTER_MAX_POINTS:
+        return 'all points'
+    if count <= ENVELOPE_MAX_POINTS:
+        description = 'min/median/90pct/max of %d points' % count
+    else:
+        description = 'density of %d points' % count
+    return description + ', slowest %d marked' % min(OUTLIER_POINTS, count)
+
+
+
+def plot_envelope(ax, x_seq, y_seq):
+    """min/max band with median and 90pct lines, per time bucket."""
+    x_min, x_max = x_seq.min(), x_seq.max()
+    width = max(x_max - x_min, 1e-9) / ENVELOPE_BUCKETS
+    buckets = numpy.minimum(((x_seq - x_min) / width).astype(numpy.int64), ENVELOPE_BUCKETS - 1)
+    order = numpy.lexsort((y_seq, buckets))
+    sorted_y = y_seq[order]
+    counts = numpy.bincount(buckets, minlength=ENVELOPE_BUCKETS)
+    filled = counts > 0
+    starts = (numpy.cumsum(counts) - counts)[filled]
+    counts = counts[filled]
+    x_mid = x_min + (numpy.flatnonzero(filled) + 0.5) * width
+    mins = sorted_y[starts]
+    maxs = sorted_y[starts + counts - 1]
+    medians = sorted_y[starts + counts // 2]
+    pct_90 = sorted_y[starts + (counts * 0.9).astype(numpy.int64)]
+    ax.fill_between(x_mid, mins, maxs, color='#9999ff', linewidth=0.0)
+    ax.plot(x_mid, medians, color='blue', linewidth=0.75)
+    ax.plot(x_mid, pct_90, color='purple', linewidth=0.75)
+
+
+
+def plot_density(ax, x_seq, y_seq):
+    """2d histogram of the points, log scaled colors."""
+    counts, x_edges, y_edges = numpy.histogram2d(x_seq, y_seq, bins=DENSITY_BINS)
+    counts = numpy.ma.masked_equal(counts, 0)
+    ax.pcolormesh(x_edges, y_edges, counts.T, cmap='Blues', norm=LogNorm(vmin=1, vmax=max(counts.max(), 1)))
+
+
+
+def plot_outliers(ax, x_seq, y_seq):
+    slowest = y_seq.argsort()[-OUTLIER_POINTS:]
+    ax.plot(x_seq[slowest], y_seq[slowest],
+        color='red', linestyle='-', linewidth=0.0, marker='o',
+        markeredgecolor='red', markerfacecolor='red', markersize=2.0)
 
 
 
@@ -77,7 +158,8 @@ def resp_graph(avg_resptime_points_dict, percentile_80_resptime_points_dict, per
             prop=matplotlib.font_manager.FontProperties(size='xx-small')
             )
 
-    savefig(dir + image_name)
+    fig.savefig(dir + image_name)
+    close(fig)
 
 
 
@@ -96,4 +178,61 @@ def tp_graph(throughputs_dict, image_name, dir='./'):
         color='red', linestyle='-', linewidth=0.75, marker='o',
         markeredgecolor='red', markerfacecolor='yellow', markersize=2.0)
     ax.plot([0.0,], [0.0,], linewidth=0.0, markersize=0.0)
-    savefig(dir + image_name)
+    fig.savefig(dir + image_name)
+    close(fig)
+
+
+
+class GraphRenderer(object):
+    """
+    renders graphs (a graph function of this module and its arguments) in a
+    pool of processes, or right away when processes is 1.
+    """
+
+    def __init__(self, processes=1):
+        self.pool = None
+        if processes > 1:
+            self.pool = multiprocessing.Pool(processes)
+        self.pending = []
+        self.count = 0
+        self.start_time = time.time()
+
+    def render(self, graph_function, *args):
+        self.count += 1
+        if self.pool is None:
+            try:
+                graph_function(*args)
+            except Exception:
+                traceback.print_exc()
+        else:
+            self.pending.append(self.pool.apply_async(graph_function, args))
+
+    def resp_graph_raw(self, *args):
+        self.render(resp_graph_raw, *args)
+
+    def resp_graph(self, *args):
+        self.render(resp_graph, *args)
+
+    def tp_graph(self, *args):
+        self.render(tp_graph, *args)
+
+    def raw_description(self, count):
+        return raw_graph_description(count)
+
+    def html(self, image_name):
+        return '<img src="%s"></img>' % image_name
+
+    def footer(self):
+        return ''
+
+    def finish(self):
+        """wait for all graphs to be written.  :returns: (number of graphs, secs)"""
+        if self.pool is not None:
+            self.pool.close()
+            for result in self.pending:
+                try:
+                    result.get()
+                except Exception:
+                    traceback.print_exc()
+            self.pool.join()
+        return self.count, time.time() - self.start_time
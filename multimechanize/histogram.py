@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+#
+#  Copyright (c) 2010-2012 Corey Goldberg (corey@goldb.org)
+#  License: GNU LGPLv3
+#
+#  This file is part of Multi-Mechanize | Performance Test Framework
+#
+
+"""
+mergeable latency histograms (HdrHistogram style) that are filled while the
+test runs, so the summary and interval tables of the report do not need the
+raw results.
+"""
+
+import json
+import math
+
+
+HISTOGRAMS_FILE = 'histograms.json'
+FORMAT_VERSION = 1
+
+
+if hasattr(int, 'bit_length'):
+    def bit_length(n):
+        return n.bit_length()
+else:  # python 2.6
+    def bit_length(n):
+        return len(bin(n)) - 2
+
+
+
+class Histogram(object):
+    """
+    log-linear histogram of durations in seconds.  values are counted in
+    integer units (microseconds by default) and grouped into buckets that
+    are never wider than 1 / 10**significant_digits of their value, so any
+    percentile read back is within that relative error.  count, min, max,
+    mean and standard deviation are tracked exactly.
+    """
+
+    def __init__(self, significant_digits=3, unit=0.000001):
+        self.significant_digits = significant_digits
+        self.unit = unit
+        self.sub_bucket_bits = int(math.ceil(math.log(2 * 10 ** significant_digits, 2)))
+        self.sub_bucket_count = 1 << self.sub_bucket_bits
+        self.sub_bucket_half_count = self.sub_bucket_count // 2
+        self.counts = {}  # {bucket index: count}
+        self.count = 0
+        self.min = None
+        self.max = None
+        self.mean = 0.0
+        self.m2 = 0.0  # sum of squared deviations from the mean
+
+    def bucket_index(self, units):
+        if units < self.sub_bucket_count:
+            return units
+        shift = bit_length(units) - self.sub_bucket_bits
+        return (self.sub_bucket_count + (shift - 1) * self.sub_bucket_half_count +
+                (units >> shift) - self.sub_bucket_half_count)
+
+    def bucket_value(self, index):
+        """highest value (secs) that falls into a bucket."""
+        if index < self.sub_bucket_count:
+            return index * self.unit
+        shift = (index - self.sub_bucket_count) // self.sub_bucket_half_count + 1
+        sub_bucket = (index - self.sub_bucket_count) % self.sub_bucket_half_count + self.sub_bucket_half_count
+        return (((sub_bucket + 1) << shift) - 1) * self.unit
+
+    def record(self, value):
+        index = self.bucket_index(max(int(value / self.unit + 0.5), 0))
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def merge(self, other):
+        """add the values recorded in another histogram of the same precision."""
+        if not other.count:
+            return
+        for index, count in other.counts.iteritems():
+            self.counts[index] = self.counts.get(index, 0) + count
+        if self.count:
+            count = self.count + other.count
+            delta = other.mean - self.mean
+            self.m2 += other.m2 + delta * delta * self.count * other.count / count
+            self.mean += delta * other.count / count
+            self.count = count
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+        else:
+            self.count = other.count
+            self.mean = other.mean
+            self.m2 = other.m2
+            self.min = other.min
+            self.max = other.max
+
+    def percentiles(self, percentiles):
+        """
+        values at several percentiles, using the same rank as
+        results.percentile(): the int(count * pct / 100)'th smallest value.
+        """
+        ranks = [(min(int(self.count * (pct / 100.0)), self.count - 1), i) for i, pct in enumerate(percentiles)]
+        ranks.sort()
+        vals = [None] * len(percentiles)
+        seen = 0
+        pending = iter(ranks)
+        rank, i = pending.next()
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            while rank < seen:
+                vals[i] = min(max(self.bucket_value(index), self.min), self.max)
+                try:
+                    rank, i = pending.next()
+                except StopIteration:
+                    return vals
+        return vals
+
+    def stdev(self):
+        if self.count < 2:
+            return 0
+        return (self.m2 / (self.count - 1)) ** .5
+
+    def stats(self):
+        """(count, min, avg, 80pct, 90pct, 95pct, max, stdev), like results.summary_stats()."""
+        pct_80, pct_90, pct_95 = self.percentiles((80, 90, 95))
+        return (self.count, self.min, self.mean, pct_80, pct_90, pct_95, self.max, self.stdev())
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'min': self.min,
+            'max': self.max,
+            'mean': self.mean,
+            'm2': self.m2,
+            'counts': [[index, self.counts[index]] for index in sorted(self.counts)],
+        }
+
+    @classmethod
+    def from_dict(cls, data, significant_digits, unit):
+        histogram = cls(significant_digits, unit)
+        histogram.count = data['count']
+        histogram.min = data['min']
+        histogram.max = data['max']
+        histogram.mean = data['mean']
+        histogram.m2 = data['m2']
+        histogram.counts = dict((index, count) for index, count in data['counts'])
+        return histogram
+
+
+
+class SeriesHistograms(object):
+    """
+    histograms of one series of timings (all transactions, a user group or
+    a custom timer): one for the whole run and one per time-series
+    interval.  intervals are counted from the first point of the series,
+    covering the points before it too, the same way results.split_series()
+    buckets raw points.
+    """
+
+    def __init__(self, interval, significant_digits, unit):
+        self.interval = interval
+        self.significant_digits = significant_digits
+        self.unit = unit
+        self.total = Histogram(significant_digits, unit)
+        self.intervals = {}  # {interval index: Histogram}
+        self.first_elapsed = None
+        self.last_elapsed = None
+
+    def record(self, elapsed, value):
+        if self.first_elapsed is None:
+            self.first_elapsed = elapsed
+        self.last_elapsed = elapsed
+        self.total.record(value)
+        index = int((elapsed - self.first_elapsed) // self.interval)
+        histogram = self.intervals.get(index)
+        if histogram is None:
+            histogram = self.intervals[index] = Histogram(self.significant_digits, self.unit)
+        histogram.record(value)
+
+    def interval_stats(self):
+        """stats tuple per interval (None for an empty one), like results.interval_stats()."""
+        if self.first_elapsed is None:
+            return []
+        series = []
+        for index in xrange(min(self.intervals), max(self.intervals) + 1):
+            histogram = self.intervals.get(index)
+            if histogram is None:
+                series.append(None)
+            else:
+                series.append(histogram.stats())
+        return series
+
+    def to_dict(self):
+        return {
+            'first_elapsed': self.first_elapsed,
+            'last_elapsed': self.last_elapsed,
+            'total': self.total.to_dict(),
+            'intervals': [[index, self.intervals[index].to_dict()] for index in sorted(self.intervals)],
+        }
+
+    @classmethod
+    def from_dict(cls, data, interval, significant_digits, unit):
+        series = cls(interval, significant_digits, unit)
+        series.first_elapsed = data['first_elapsed']
+        series.last_elapsed = data['last_elapsed']
+        series.total = Histogram.from_dict(data['total'], significant_digits, unit)
+        for index, histogram in data['intervals']:
+            series.intervals[index] = Histogram.from_dict(histogram, significant_digits, unit)
+        return series
+
+
+
+class ResultsHistograms(object):
+    """
+    streaming aggregate of a results file: totals plus SeriesHistograms for
+    all transactions, each user group and each custom timer.  records at or
+    past run_time are counted in the totals but not in the histograms,
+    matching what results.Results keeps for analysis.
+    """
+
+    def __init__(self, run_time, interval, significant_digits=3, unit=0.000001):
+        self.run_time = run_time
+        self.interval = interval
+        self.significant_digits = significant_digits
+        self.unit = unit
+        self.total_transactions = 0
+        self.total_errors = 0
+        self.epoch_start = None
+        self.epoch_finish = None
+        self.transactions = SeriesHistograms(interval, significant_digits, unit)
+        self.user_groups = {}
+        self.timers = {}
+
+    def series(self, collection, name):
+        series = collection.get(name)
+        if series is None:
+            series = collection[name] = SeriesHistograms(self.interval, self.significant_digits, self.unit)
+        return series
+
+    def record(self, elapsed, epoch, user_group_name, trans_time, error, custom_timers):
+        self.total_transactions += 1
+        if error != '':
+            self.total_errors += 1
+        if elapsed >= self.run_time:
+            return
+        if self.epoch_start is None or epoch < self.epoch_start:
+            self.epoch_start = epoch
+        if self.epoch_finish is None or epoch > self.epoch_finish:
+            self.epoch_finish = epoch
+        self.transactions.record(elapsed, trans_time)
+        self.series(self.user_groups, user_group_name).record(elapsed, trans_time)
+        for timer_name, value in custom_timers.iteritems():
+            self.series(self.timers, timer_name).record(elapsed, float(value))
+
+    def save(self, file_name):
+        data = {
+            'version': FORMAT_VERSION,
+            'run_time': self.run_time,
+            'interval': self.interval,
+            'significant_digits': self.significant_digits,
+            'unit': self.unit,
+            'total_transactions': self.total_transactions,
+            'total_errors': self.total_errors,
+            'epoch_start': self.epoch_start,
+            'epoch_finish': self.epoch_finish,
+            'transactions': self.transactions.to_dict(),
+            'user_groups': dict((name, series.to_dict()) for name, series in self.user_groups.iteritems()),
+            'timers': dict((name, series.to_dict()) for name, series in self.timers.iteritems()),
+        }
+        with open(file_name, 'w') as f:
+            json.dump(data, f, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, file_name):
+        with open(file_name) as f:
+            data = json.load(f)
+        if data.get('version') != FORMAT_VERSION:
+            raise ValueError('unsupported histograms file version: %s' % data.get('version'))
+        interval = data['interval']
+        significant_digits = data['significant_digits']
+        unit = data['unit']
+        histograms = cls(data['run_time'], interval, significant_digits, unit)
+        histograms.total_transactions = data['total_transactions']
+        histograms.total_errors = data['total_errors']
+        histograms.epoch_start = data['epoch_start']
+        histograms.epoch_finish = data['epoch_finish']
+        histograms.transactions = SeriesHistograms.from_dict(data['transactions'], interval, significant_digits, unit)
+        for name, series in data['user_groups'].iteritems():
+            histograms.user_groups[name] = SeriesHistograms.from_dict(series, interval, significant_digits, unit)
+        for name, series in data['timers'].iteritems():
+            histograms.timers[name] = SeriesHistograms.from_dict(series, interval, significant_digits, unit)
+        return histograms
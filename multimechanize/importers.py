@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+#
+#  Copyright (c) 2010-2012 Corey Goldberg (corey@goldb.org)
+#  License: GNU LGPLv3
+#
+#  This file is part of Multi-Mechanize | Performance Test Framework
+#
+
+"""
+readers for results files written by other tools.  a reader turns a file
+into the same stream of records resultsfile.read_results() yields, so
+Results and StreamingResults analyze (and report on) it like a
+multi-mechanize run.  files are read incrementally; memory use does not
+depend on the size of the file.
+
+  jtl      JMeter XML results.  every top-level sample is a transaction,
+           named after its label; the samples nested in it (e.g. the
+           samplers of a transaction controller) become its custom timers.
+  jtl-csv  JMeter CSV results, with the default header.
+  csv      any CSV file, with a column mapping (see CsvReader).
+
+tools write samples when they finish, not in the order they started, so
+a reader first scans the file for its earliest timestamp and counts
+elapsed times from there.  new formats can be added to READERS.
+"""
+
+import csv
+import mmap
+import os
+import re
+
+try:
+    from xml.etree import cElementTree as ET
+except ImportError:
+    from xml.etree import ElementTree as ET
+
+
+SAMPLE_TAGS = ('sample', 'httpSample')
+SAMPLE_TIMESTAMP = re.compile(r'<(?:sample|httpSample)\b[^>]*?\sts="(-?\d+)"')
+SUCCESS_VALUES = ('true', '1', 'yes', 'ok')
+UNITS = {'s': 1.0, 'ms': 0.001, 'us': 0.000001, 'ns': 0.000000001}
+
+# column mapping of JMeter CSV results
+JTL_CSV_COLUMNS = {
+    'timestamp': 'timeStamp',
+    'time': 'elapsed',
+    'label': 'label',
+    'success': 'success',
+    'message': 'responseMessage',
+}
+
+
+
+def record(request_num, start_ts, ts, trans_time, label, error, custom_timers):
+    """
+    a results record of a transaction that started at ts (secs since the
+    epoch) and took trans_time secs; start_ts is the start of the test.
+    """
+    start_ns = int(ts * 1000000000)
+    return (request_num, ts - start_ts, int(ts), label, trans_time, error, custom_timers,
+            start_ns, start_ns + int(trans_time * 1000000000))
+
+
+
+class JtlXmlReader(object):
+    """JMeter XML results, parsed with iterparse and cleared as it goes."""
+
+    cache_key = 'jtl'
+
+    def __call__(self, file_name):
+        return self.read(file_name)
+
+    def start_ts(self, file_name):
+        """earliest sample timestamp (secs since the epoch) in a file, or None."""
+        if os.path.getsize(file_name) == 0:
+            return None
+        with open(file_name, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                start_ms = None
+                for match in SAMPLE_TIMESTAMP.finditer(data):
+                    ts = int(match.group(1))
+                    if start_ms is None or ts < start_ms:
+                        start_ms = ts
+            finally:
+                data.close()
+        if start_ms is None:
+            return None
+        return start_ms / 1000.0
+
+    def read(self, file_name):
+        request_num = 0
+        start_ts = self.start_ts(file_name)
+        root = None
+        samples = []  # open sample elements, outermost first
+        timers = []   # custom timers of the open sample elements
+        for event, element in ET.iterparse(file_name, events=('start', 'end')):
+            if element.tag not in SAMPLE_TAGS:
+                if root is None and event == 'start':
+                    root = element
+                continue
+            if event == 'start':
+                samples.append(element)
+                timers.append({})
+                continue
+            samples.pop()
+            custom_timers = timers.pop()
+            trans_time = int(element.get('t', 0)) / 1000.0
+            if samples:
+                if len(samples) == 1:  # a sub-sample of a transaction
+                    label = element.get('lb', '')
+                    timers[-1][label] = timers[-1].get(label, 0.0) + trans_time
+                continue
+            ts = int(element.get('ts', 0)) / 1000.0
+            request_num += 1
+            error = ''
+            if element.get('s', 'true') != 'true':
+                error = '%s %s' % (element.get('rc', ''), element.get('rm', ''))
+                error = error.strip() or 'failed'
+            yield record(request_num, start_ts, ts, trans_time, element.get('lb', ''), error, custom_timers)
+            element.clear()
+            if root is not None:
+                root.clear()
+
+
+
+class CsvReader(object):
+    """
+    CSV results with a column mapping: {field: column}, columns given by
+    name (header=True) or by 0-based index.  fields:
+
+      timestamp  start of the transaction (required)
+      time       duration of the transaction (required)
+      label      name of the transaction (the user group in the report)
+      error      error message, empty for a successful transaction
+      success    true/1/yes/ok for a successful transaction
+      message    error message used with success
+      timers     comma separated columns reported as custom timers
+
+    timestamp_unit and time_unit are s, ms, us or ns.
+    """
+
+    def __init__(self, columns, timestamp_unit='ms', time_unit='ms', header=True, delimiter=','):
+        for field in ('timestamp', 'time'):
+            if field not in columns:
+                raise ValueError('csv column mapping needs a %s column' % field)
+        for unit in (timestamp_unit, time_unit):
+            if unit not in UNITS:
+                raise ValueError('unknown unit %s (use %s)' % (unit, ', '.join(sorted(UNITS))))
+        self.columns = columns
+        self.timestamp_scale = UNITS[timestamp_unit]
+        self.time_scale = UNITS[time_unit]
+        self.header = header
+        self.delimiter = delimiter
+        # everything that changes the records read from a file
+        self.cache_key = 'csv %r' % ((sorted(columns.items()), self.timestamp_scale, self.time_scale, header, delimiter),)
+
+    def __call__(self, file_name):
+        return self.read(file_name)
+
+    def column_indexes(self, header_row):
+        def index(column):
+            column = column.strip()
+            if header_row is None:
+                return int(column)
+            try:
+                return header_row.index(column)
+            except ValueError:
+                raise ValueError('no %s column in the csv header' % column)
+        indexes = dict((field, index(column)) for field, column in self.columns.iteritems()
+                       if field != 'timers' and column)
+        timer_columns = [column for column in self.columns.get('timers', '').split(',') if column.strip()]
+        timers = [(column.strip(), index(column)) for column in timer_columns]
+        return indexes, timers
+
+    def rows(self, f):
+        """:returns: (csv reader of the rows of a file, indexes of the mapped fields, timer columns)"""
+        rows = csv.reader(f, delimiter=self.delimiter)
+        header_row = None
+        if self.header:
+            header_row = rows.next()
+        indexes, timers = self.column_indexes(header_row)
+        return rows, indexes, timers
+
+    def start_ts(self, file_name):
+        """earliest timestamp (secs since the epoch) in a file, or None."""
+        start_ts = None
+        with open(file_name, 'rb') as f:
+            rows, indexes, timers = self.rows(f)
+            timestamp_index = indexes['timestamp']
+            for row in rows:
+                if row:
+                    ts = float(row[timestamp_index])
+                    if start_ts is None or ts < start_ts:
+                        start_ts = ts
+        if start_ts is None:
+            return None
+        return start_ts * self.timestamp_scale
+
+    def read(self, file_name):
+        timestamp_scale = self.timestamp_scale
+        time_scale = self.time_scale
+        start_ts = self.start_ts(file_name)
+        with open(file_name, 'rb') as f:
+            rows, indexes, timers = self.rows(f)
+            timestamp_index = indexes['timestamp']
+            time_index = indexes['time']
+            label_index = indexes.get('label')
+            error_index = indexes.get('error')
+            success_index = indexes.get('success')
+            message_index = indexes.get('message')
+            for request_num, row in enumerate(rows, 1):
+                if not row:
+                    continue
+                ts = float(row[timestamp_index]) * timestamp_scale
+                label = ''
+                if label_index is not None:
+                    label = row[label_index]
+                error = ''
+                if error_index is not None:
+                    error = row[error_index]
+                elif success_index is not None and row[success_index].lower() not in SUCCESS_VALUES:
+                    if message_index is not None:
+                        error = row[message_index]
+                    error = error or 'failed'
+                custom_timers = {}
+                for timer_name, index in timers:
+                    if row[index] != '':
+                        custom_timers[timer_name] = float(row[index]) * time_scale
+                yield record(request_num, start_ts, ts, float(row[time_index]) * time_scale, label, error,
+                             custom_timers)
+
+
+
+READERS = {
+    'jtl': JtlXmlReader,
+    'jtl-csv': lambda: CsvReader(JTL_CSV_COLUMNS),
+    'csv': CsvReader,
+}
+
+
+
+def get_reader(format, *args, **kwargs):
+    """
+    :returns: a reader of files in a foreign format: called with a file
+              name, it yields the records of the file.  its cache_key tells
+              resultscache which reader and options parsed a file.
+    """
+    try:
+        reader_class = READERS[format]
+    except KeyError:
+        raise ValueError('unknown results format %s (use %s)' % (format, ', '.join(sorted(READERS))))
+    return reader_class(*args, **kwargs)
+
+
+
+def detect_format(file_name):
+    """guess jtl or jtl-csv from the start of a file."""
+    with open(file_name, 'rb') as f:
+        start = f.read(1024).lstrip()
+    if start.startswith('<'):
+        return 'jtl'
+    if start.startswith('timeStamp'):
+        return 'jtl-csv'
+    return None
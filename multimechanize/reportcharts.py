@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+#
+#  Copyright (c) 2010-2012 Corey Goldberg (corey@goldb.org)
+#  License: GNU LGPLv3
+#
+#  This file is part of Multi-Mechanize | Performance Test Framework
+#
+
+"""
+interactive report graphs: instead of rendering PNGs with matplotlib, the
+data of every graph is pre-aggregated (interval series as they are, raw
+points as a per time bucket envelope plus the slowest points) and embedded
+in results.html as JSON, where a small script draws it on canvas elements.
+drag across a graph to zoom in on a time range, double-click to zoom out.
+"""
+
+import json
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# raw response times are embedded as they are up to RAW_MAX_POINTS, as an
+# envelope of ENVELOPE_BUCKETS time buckets beyond
+RAW_MAX_POINTS = 2000
+ENVELOPE_BUCKETS = 400
+OUTLIER_POINTS = 200
+
+
+
+def envelope(points, buckets=ENVELOPE_BUCKETS):
+    """
+    :returns: {'x': bucket middles, 'min': [...], 'median': [...], '90pct': [...], 'max': [...]}
+              of the (elapsed, value) points in equal width time buckets (empty ones left out).
+    """
+    if numpy is not None:
+        return _numpy_envelope(points, buckets)
+    x_min = min(x for x, y in points)
+    x_max = max(x for x, y in points)
+    width = max(x_max - x_min, 1e-9) / buckets
+    bucket_vals = {}
+    for x, y in points:
+        bucket_vals.setdefault(min(int((x - x_min) / width), buckets - 1), []).append(y)
+    series = {'x': [], 'min': [], 'median': [], '90pct': [], 'max': []}
+    for bucket in sorted(bucket_vals):
+        vals = sorted(bucket_vals[bucket])
+        series['x'].append(x_min + (bucket + 0.5) * width)
+        series['min'].append(vals[0])
+        series['median'].append(vals[len(vals) // 2])
+        series['90pct'].append(vals[int(len(vals) * 0.9)])
+        series['max'].append(vals[-1])
+    return series
+
+
+
+def _numpy_envelope(points, buckets):
+    points = numpy.array(points, dtype=numpy.float64)
+    x_seq, y_seq = points[:, 0], points[:, 1]
+    x_min = x_seq.min()
+    width = max(x_seq.max() - x_min, 1e-9) / buckets
+    bucket = numpy.minimum(((x_seq - x_min) / width).astype(numpy.int64), buckets - 1)
+    sorted_y = y_seq[numpy.lexsort((y_seq, bucket))]
+    counts = numpy.bincount(bucket, minlength=buckets)
+    filled = counts > 0
+    starts = (numpy.cumsum(counts) - counts)[filled]
+    counts = counts[filled]
+    return {
+        'x': (x_min + (numpy.flatnonzero(filled) + 0.5) * width).tolist(),
+        'min': sorted_y[starts].tolist(),
+        'median': sorted_y[starts + counts // 2].tolist(),
+        '90pct': sorted_y[starts + (counts * 0.9).astype(numpy.int64)].tolist(),
+        'max': sorted_y[starts + counts - 1].tolist(),
+    }
+
+
+
+def _rounded(vals):
+    return [round(val, 6) for val in vals]
+
+
+
+class ChartCollector(object):
+    """
+    collects the graphs of a report, with the same calls as
+    graph.GraphRenderer, and writes them out as embedded chart data.
+    """
+
+    def __init__(self):
+        self.charts = {}  # {chart id: chart data}
+        self.start_time = time.time()
+
+    def chart_id(self, image_name):
+        return image_name.rsplit('.', 1)[0]
+
+    def raw_description(self, count):
+        if count <= RAW_MAX_POINTS:
+            return 'all points'
+        return 'min/median/90pct/max of %d points, slowest %d marked' % (count, min(OUTLIER_POINTS, count))
+
+    def resp_graph_raw(self, nested_resp_list, image_name, dir='./'):
+        if hasattr(nested_resp_list, 'tolist'):  # an (n, 2) numpy array
+            points = nested_resp_list.tolist()
+        else:
+            points = list(nested_resp_list)
+        if len(points) <= RAW_MAX_POINTS:
+            chart = {
+                'x': _rounded(x for x, y in points),
+                'series': [{'label': 'response time', 'color': 'blue', 'points': True,
+                            'y': _rounded(y for x, y in points)}],
+            }
+        else:
+            series = envelope(points)
+            slowest = sorted(points, key=lambda point: point[1])[-OUTLIER_POINTS:]
+            chart = {
+                'x': _rounded(series['x']),
+                'series': [
+                    {'label': 'max', 'color': '#9999ff', 'y': _rounded(series['max'])},
+                    {'label': '90pct', 'color': 'purple', 'y': _rounded(series['90pct'])},
+                    {'label': 'median', 'color': 'blue', 'y': _rounded(series['median'])},
+                    {'label': 'min', 'color': '#9999ff', 'y': _rounded(series['min'])},
+                ],
+                'outliers': [[round(x, 6), round(y, 6)] for x, y in slowest],
+            }
+        chart['ylabel'] = 'Response Time (secs)'
+        self.charts[self.chart_id(image_name)] = chart
+
+    def resp_graph(self, avg_resptime_points_dict, percentile_80_resptime_points_dict,
+                   percentile_90_resptime_points_dict, image_name, dir='./'):
+        x_seq = sorted(avg_resptime_points_dict)
+        self.charts[self.chart_id(image_name)] = {
+            'x': x_seq,
+            'series': [
+                {'label': '90pct', 'color': 'purple', 'y': _rounded(percentile_90_resptime_points_dict[x] for x in x_seq)},
+                {'label': '80pct', 'color': 'orange', 'y': _rounded(percentile_80_resptime_points_dict[x] for x in x_seq)},
+                {'label': 'Avg', 'color': 'green', 'y': _rounded(avg_resptime_points_dict[x] for x in x_seq)},
+            ],
+            'ylabel': 'Response Time (secs)',
+        }
+
+    def tp_graph(self, throughputs_dict, image_name, dir='./'):
+        x_seq = sorted(throughputs_dict)
+        self.charts[self.chart_id(image_name)] = {
+            'x': x_seq,
+            'series': [{'label': 'throughput', 'color': 'red', 'y': _rounded(throughputs_dict[x] for x in x_seq)}],
+            'ylabel': 'Transactions Per Second (count)',
+        }
+
+    def html(self, image_name):
+        return '<canvas class="chart" width="800" height="330" data-chart="%s"></canvas>' % self.chart_id(image_name)
+
+    def footer(self):
+        data = json.dumps(self.charts, separators=(',', ':')).replace('</', '<\\/')
+        return '<script type="text/javascript">\nvar CHARTS = %s;\n%s</script>' % (data, CHART_SCRIPT)
+
+    def finish(self):
+        """:returns: (number of graphs, secs)"""
+        return len(self.charts), time.time() - self.start_time
+
+
+
+CHART_SCRIPT = """\
+(function () {
+    var PAD = {left: 60, right: 15, top: 15, bottom: 35};
+
+    function ticks(lo, hi, n) {
+        var step = Math.pow(10, Math.floor(Math.log(Math.max(hi - lo, 1e-9) / n) / Math.LN10));
+        if ((hi - lo) / step > n * 5) { step *= 5; } else if ((hi - lo) / step > n * 2) { step *= 2; }
+        var out = [];
+        for (var t = Math.ceil(lo / step) * step; t <= hi + step * 1e-6; t += step) { out.push(t); }
+        return out;
+    }
+
+    function draw(canvas, chart, x0, x1) {
+        var ctx = canvas.getContext('2d');
+        var w = canvas.width, h = canvas.height;
+        var i, j, s, y0 = 0, y1 = 0;
+        for (j = 0; j < chart.series.length; j++) {
+            for (i = 0; i < chart.x.length; i++) {
+                if (chart.x[i] >= x0 && chart.x[i] <= x1) { y1 = Math.max(y1, chart.series[j].y[i]); }
+            }
+        }
+        var outliers = chart.outliers || [];
+        for (i = 0; i < outliers.length; i++) {
+            if (outliers[i][0] >= x0 && outliers[i][0] <= x1) { y1 = Math.max(y1, outliers[i][1]); }
+        }
+        y1 = y1 * 1.05 || 1;
+        if (x1 <= x0) { x1 = x0 + 1; }
+        function px(x) { return PAD.left + (x - x0) / (x1 - x0) * (w - PAD.left - PAD.right); }
+        function py(y) { return h - PAD.bottom - (y - y0) / (y1 - y0) * (h - PAD.top - PAD.bottom); }
+        canvas.px = px;
+
+        ctx.clearRect(0, 0, w, h);
+        ctx.font = '10px Verdana, sans-serif';
+        ctx.strokeStyle = '#cccccc';
+        ctx.fillStyle = '#000000';
+        ctx.lineWidth = 1;
+        var t = ticks(x0, x1, 8);
+        ctx.textAlign = 'center';
+        for (i = 0; i < t.length; i++) {
+            ctx.beginPath(); ctx.moveTo(px(t[i]), PAD.top); ctx.lineTo(px(t[i]), h - PAD.bottom); ctx.stroke();
+            ctx.fillText(+t[i].toFixed(3), px(t[i]), h - PAD.bottom + 12);
+        }
+        ctx.fillText('Elapsed Time In Test (secs)', w / 2, h - 5);
+        t = ticks(y0, y1, 5);
+        ctx.textAlign = 'right';
+        for (i = 0; i < t.length; i++) {
+            ctx.beginPath(); ctx.moveTo(PAD.left, py(t[i])); ctx.lineTo(w - PAD.right, py(t[i])); ctx.stroke();
+            ctx.fillText(+t[i].toFixed(3), PAD.left - 4, py(t[i]) + 3);
+        }
+        ctx.save();
+        ctx.translate(12, h / 2); ctx.rotate(-Math.PI / 2); ctx.textAlign = 'center';
+        ctx.fillText(chart.ylabel, 0, 0);
+        ctx.restore();
+
+        ctx.save();
+        ctx.beginPath(); ctx.rect(PAD.left, PAD.top, w - PAD.left - PAD.right, h - PAD.top - PAD.bottom); ctx.clip();
+        for (j = 0; j < chart.series.length; j++) {
+            s = chart.series[j];
+            ctx.strokeStyle = ctx.fillStyle = s.color;
+            ctx.beginPath();
+            for (i = 0; i < chart.x.length; i++) {
+                if (s.points) {
+                    ctx.fillRect(px(chart.x[i]) - 1, py(s.y[i]) - 1, 2, 2);
+                } else if (i === 0) {
+                    ctx.moveTo(px(chart.x[i]), py(s.y[i]));
+                } else {
+                    ctx.lineTo(px(chart.x[i]), py(s.y[i]));
+                }
+            }
+            ctx.stroke();
+        }
+        ctx.fillStyle = 'red';
+        for (i = 0; i < outliers.length; i++) {
+            ctx.fillRect(px(outliers[i][0]) - 1.5, py(outliers[i][1]) - 1.5, 3, 3);
+        }
+        ctx.restore();
+
+        ctx.textAlign = 'left';
+        for (j = 0; j < chart.series.length; j++) {
+            ctx.fillStyle = chart.series[j].color;
+            ctx.fillText(chart.series[j].label, w - PAD.right - 70, PAD.top + 12 * (j + 1));
+        }
+    }
+
+    function setup(canvas) {
+        var chart = CHARTS[canvas.getAttribute('data-chart')];
+        if (!chart) { return; }
+        var xs = chart.x.concat((chart.outliers || []).map(function (p) { return p[0]; }));
+        var lo = Math.min(0, Math.min.apply(null, xs)), hi = Math.max.apply(null, xs.concat([1]));
+        var view = [lo, hi], dragStart = null;
+        function toX(event) {
+            var rect = canvas.getBoundingClientRect();
+            var frac = (event.clientX - rect.left - PAD.left) / (canvas.width - PAD.left - PAD.right);
+            return view[0] + Math.max(0, Math.min(1, frac)) * (view[1] - view[0]);
+        }
+        canvas.onmousedown = function (event) { dragStart = toX(event); };
+        canvas.onmouseup = function (event) {
+            if (dragStart === null) { return; }
+            var end = toX(event);
+            if (Math.abs(end - dragStart) > (view[1] - view[0]) / 200) {
+                view = [Math.min(dragStart, end), Math.max(dragStart, end)];
+                draw(canvas, chart, view[0], view[1]);
+            }
+            dragStart = null;
+        };
+        canvas.ondblclick = function () { view = [lo, hi]; draw(canvas, chart, lo, hi); };
+        draw(canvas, chart, lo, hi);
+    }
+
+    var canvases = document.getElementsByTagName('canvas');
+    for (var i = 0; i < canvases.length; i++) {
+        if (canvases[i].className === 'chart') { setup(canvases[i]); }
+    }
+})();
+"""
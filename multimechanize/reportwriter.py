@@ -7,16 +7,44 @@
 #
 
 
+class ReportSection(object):
+    """lines of one part of a report, buffered until the report is closed."""
+
+    def __init__(self):
+        self.lines = []
+
+
+    def write_line(self, line):
+        self.lines.append('%s\n' % line)
+
+
+
 class Report(object):
+    """
+    results.html.  the head is written right away; all other lines are
+    kept in memory and written through one file handle by
+    write_closing_html().  section() reserves a place in the report that
+    can be filled independently (e.g. one per custom timer, by different
+    threads): the report reads in the order the sections were created, not
+    the order they were filled.
+    """
+
     def __init__(self, results_dir):
         self.results_dir = results_dir
         self.fn = results_dir + 'results.html'
+        self.parts = [ReportSection()]
         self.write_head_html()
 
 
     def write_line(self, line):
-        with open(self.fn, 'a') as f:
-            f.write('%s\n' % line)
+        self.parts[-1].write_line(line)
+
+
+    def section(self):
+        section = ReportSection()
+        self.parts.append(section)
+        self.parts.append(ReportSection())  # for the lines written to the report after it
+        return section
 
 
     def write_head_html(self):
@@ -95,6 +123,9 @@ class Report(object):
 
     def write_closing_html(self):
         with open(self.fn, 'a') as f:
+            for part in self.parts:
+                f.writelines(part.lines)
+            self.parts = [ReportSection()]
             f.write("""\
 </body>
 </html>
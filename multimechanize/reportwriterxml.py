@@ -7,54 +7,75 @@
 #
 
 
-from xml.etree import ElementTree as ET
+import os
+import shutil
+from xml.sax.saxutils import escape
+
+
+LAST_RESULTS_FILE = 'last_results.jtl'
+WRITE_BUFFER_SIZE = 1024 * 1024
+ATTRIBUTE_ENTITIES = {'"': '&quot;', '\n': '&#10;'}
 
 
 
 def write_jmeter_output(mm_data, output_path):
     """
-    Take the list of ResponseStats objects and write a JMeter 2.1
-    formatted XML file to output_path.
+    Take an iterable of ResponseStats objects and write a JMeter 2.1
+    formatted XML file to output_path.  samples are written as they
+    are read, so memory use does not grow with the number of samples.
+    the file is then hard-linked (or copied) to last_results.jtl.
 
     JMeter JTL file documentation:
     http://jakarta.apache.org/jmeter/usermanual/listeners.html
     """
-    root = ET.Element('testResults')
-    root.set('version', "1.2")
-
-    for test_transaction in mm_data:
-        # each transaction might have multiple timers
-        transaction_root = ET.SubElement(root, 'sample')
-        # JMeter uses ms for time
-        ms_trans_time = test_transaction.trans_time * 1000
-        transaction_root.set('t', '%d' % ms_trans_time)
+    file_name = os.path.join(output_path, 'results.jtl')
+    with open(file_name, 'wb', WRITE_BUFFER_SIZE) as f:
+        f.write('<testResults version="1.2">')
+        for test_transaction in mm_data:
+            f.write(sample_xml(test_transaction))
+        f.write('</testResults>')
+    link_or_copy(file_name, LAST_RESULTS_FILE)
+
+
+
+def sample_xml(test_transaction):
+    """the <sample> element of a transaction, with each custom timer as a sub-sample."""
+    # JMeter uses ms for time
+    ms_trans_time = test_transaction.trans_time * 1000
+    if test_transaction.start_ns is not None:
+        ms_timestamp = test_transaction.start_ns // 1000000
+    else:
         ms_timestamp = test_transaction.epoch_secs * 1000
-        transaction_root.set('ts', '%d' % ms_timestamp)
-        transaction_root.set('lb', test_transaction.user_group_name)  # label
-        transaction_root.set('sc', '1')  # sample count
-
-        if test_transaction.error:
-            transaction_root.set('ec', '1') # was an error
-            transaction_root.set('s', 'false') # was an error
-            # errors don't have custom_timers
-            continue
-        else:
-            transaction_root.set('ec', '0')
-            transaction_root.set('s', 'true')
-
-        # parse the custom_timers and add each as a JMeter sub-sample
-        for timer_name, timer_duration in test_transaction.custom_timers.items():
-            timer_duration = float(timer_duration)
-            timer_element = ET.SubElement(transaction_root, 'sample')
-            ms_trans_time = timer_duration * 1000
-            timer_element.set('t', '%d' % ms_trans_time)
-            # subtimers don't have timestamps, so use the Transaction ts
-            timer_element.set('ts', '%d' % ms_timestamp)
-            timer_element.set('lb', timer_name)
-            timer_element.set('sc', '1')
-            timer_element.set('ec', '0')
-            timer_element.set('s', 'true')
-
-    tree = ET.ElementTree(root)
-    tree.write(output_path + '/results.jtl')
-    tree.write('last_results.jtl')
+    label = _attribute(test_transaction.user_group_name)
+
+    if test_transaction.error:
+        # errors don't have custom_timers
+        return '<sample ec="1" lb=%s s="false" sc="1" t="%d" ts="%d" />' % (label, ms_trans_time, ms_timestamp)
+    if not test_transaction.custom_timers:
+        return '<sample ec="0" lb=%s s="true" sc="1" t="%d" ts="%d" />' % (label, ms_trans_time, ms_timestamp)
+
+    parts = ['<sample ec="0" lb=%s s="true" sc="1" t="%d" ts="%d">' % (label, ms_trans_time, ms_timestamp)]
+    for timer_name, timer_duration in test_transaction.custom_timers.items():
+        # subtimers don't have timestamps, so use the Transaction ts
+        parts.append('<sample ec="0" lb=%s s="true" sc="1" t="%d" ts="%d" />' %
+                     (_attribute(timer_name), float(timer_duration) * 1000, ms_timestamp))
+    parts.append('</sample>')
+    return ''.join(parts)
+
+
+
+def _attribute(value):
+    """quoted, ascii-only attribute value."""
+    if not isinstance(value, unicode):
+        value = str(value).decode('utf-8', 'replace')
+    return '"%s"' % escape(value, ATTRIBUTE_ENTITIES).encode('ascii', 'xmlcharrefreplace')
+
+
+
+def link_or_copy(source, destination):
+    if os.path.lexists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except (AttributeError, OSError):  # no hard links on this platform or file system
+        shutil.copyfile(source, destination)
@@ -7,20 +7,62 @@
 #
 
 
+import array
+import os
+import random
 import time
+import multiprocessing
 from collections import defaultdict
-import graph
+import histogram
+import reportcharts
 import reportwriter
 import reportwriterxml
+import resultscache
+import resultsfile
 import traceback
 import re
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 DEBUG_TIMERNAME="Homefeed"
 
-def output_results(results_dir, results_file, run_time, rampup, ts_interval, user_group_configs=None, xml_reports=False):
-    results = Results(results_dir + results_file, run_time)
+# results.csv files smaller than this are always parsed in a single process
+PARALLEL_MIN_SIZE = 8 * 1024 * 1024
+
+# nanosecond stamps need 64 bit integers; where a C long is smaller they
+# are kept as doubles (exact to within a microsecond)
+NS_TYPECODE = array.array('l').itemsize >= 8 and 'l' or 'd'
+
+def output_results(results_dir, results_file, run_time, rampup, ts_interval, user_group_configs=None, xml_reports=False,
+                   streaming=False, sample_size=10000, significant_digits=3, processes=1, cache=False,
+                   report_graphs='png', reader=None):
+    """
+    analyze a results file and write the report to results_dir.  reader
+    reads a file of another tool (see importers); its run_time can be None
+    to keep all records and report the time they span.
+    """
+    results_file_name = os.path.join(results_dir, results_file)
+    record_limit = run_time
+    if run_time is None:
+        record_limit = float('inf')
+    if streaming:
+        results = StreamingResults(results_file_name, record_limit, ts_interval, sample_size, significant_digits, reader=reader)
+        histograms = results.histograms
+        analysis = results
+    else:
+        results = Results(results_file_name, record_limit, processes, cache, reader)
+        histograms = None
+        if reader is None:  # histograms saved during a run describe its own results file
+            histograms = load_histograms(results_dir, record_limit, ts_interval)
+        analysis = analysis_backend(results, ts_interval)
+    if run_time is None:
+        run_time = results.epoch_finish - results.epoch_start
 
     report = reportwriter.Report(results_dir)
+    graphs = graph_renderer(report_graphs, processes)
 
     print 'transactions: %i' % results.total_transactions
     print 'errors: %i' % results.total_errors
@@ -31,7 +73,10 @@ def output_results(results_dir, results_file, run_time, rampup, ts_interval, use
 
     # write the results in XML
     if xml_reports:
-        reportwriterxml.write_jmeter_output(results.resp_stats_list, results_dir)
+        if streaming:
+            reportwriterxml.write_jmeter_output(results.iter_resp_stats(), results_dir)
+        else:
+            reportwriterxml.write_jmeter_output(results.resp_stats_list, results_dir)
 
     report.write_line('<h1>Performance Results Report</h1>')
 
@@ -58,87 +103,39 @@ def output_results(results_dir, results_file, run_time, rampup, ts_interval, use
     report.write_line('<h2>All Transactions</h2>')
 
     # all transactions - response times
-    trans_timer_points = []  # [elapsed, timervalue]
-    trans_timer_vals = []
-    for resp_stats in results.resp_stats_list:
-        t = (resp_stats.elapsed_time, resp_stats.trans_time)
-        trans_timer_points.append(t)
-        trans_timer_vals.append(resp_stats.trans_time)
-    graph.resp_graph_raw(trans_timer_points, 'All_Transactions_response_times.png', results_dir)
+    points = analysis.points()
+    raw_description = raw_points_description(graphs, analysis, points)
+    graphs.resp_graph_raw(points, 'All_Transactions_response_times.png', results_dir)
+
+    if histograms is not None:
+        summary = histograms.transactions.total.stats()
+        intervals = histograms.transactions.interval_stats()
+    else:
+        summary, intervals = analysis.stats()
 
     report.write_line('<h3>Transaction Response Summary (secs)</h3>')
-    report.write_line('<table>')
-    report.write_line('<tr><th>count</th><th>min</th><th>avg</th><th>80pct</th><th>90pct</th><th>95pct</th><th>max</th><th>stdev</th></tr>')
-    report.write_line('<tr><td>%i</td><td>%.3f</td><td>%.3f</td><td>%.3f</td><td>%.3f</td><td>%.3f</td><td>%.3f</td><td>%.3f</td></tr>'  % (
-        results.total_transactions,
-        min(trans_timer_vals),
-        average(trans_timer_vals),
-        percentile(trans_timer_vals, 80),
-        percentile(trans_timer_vals, 90),
-        percentile(trans_timer_vals, 95),
-        max(trans_timer_vals),
-        standard_dev(trans_timer_vals),
-    ))
-    report.write_line('</table>')
+    write_summary_table(report, (results.total_transactions,) + summary[1:])
 
 
     # all transactions - interval details
-    avg_resptime_points = {}  # {intervalnumber: avg_resptime}
-    percentile_80_resptime_points = {}  # {intervalnumber: 80pct_resptime}
-    percentile_90_resptime_points = {}  # {intervalnumber: 90pct_resptime}
     interval_secs = ts_interval
-    splat_series = split_series(trans_timer_points, interval_secs)
-    report.write_line('<h3>Interval Details (secs)</h3>')
-    report.write_line('<table>')
-    report.write_line('<tr><th>interval</th><th>count</th><th>rate</th><th>min</th><th>avg</th><th>80pct</th><th>90pct</th><th>95pct</th><th>max</th><th>stdev</th></tr>')
-    for i, bucket in enumerate(splat_series):
-        interval_start = int((i + 1) * interval_secs)
-        cnt = len(bucket)
-
-        if cnt == 0:
-            report.write_line('<tr><td>%i</td><td>0</td><td>0</td><td>N/A</td><td>N/A</td><td>N/A</td><td>N/A</td><td>N/A</td><td>N/A</td><td>N/A</td></tr>' % (i + 1))
-        else:
-            rate = cnt / float(interval_secs)
-            mn = min(bucket)
-            avg = average(bucket)
-            pct_80 = percentile(bucket, 80)
-            pct_90 = percentile(bucket, 90)
-            pct_95 = percentile(bucket, 95)
-            mx = max(bucket)
-            stdev = standard_dev(bucket)
-            report.write_line('<tr><td>%i</td><td>%i</td><td>%.2f</td><td>%.3f</td><td>%.3f</td><td>%.3f</td><td>%.3f</td><td>%.3f</td><td>%.3f</td><td>%.3f</td></tr>' % (i + 1, cnt, rate, mn, avg, pct_80, pct_90, pct_95, mx, stdev))
-
-            avg_resptime_points[interval_start] = avg
-            percentile_80_resptime_points[interval_start] = pct_80
-            percentile_90_resptime_points[interval_start] = pct_90
-
-    report.write_line('</table>')
-    graph.resp_graph(avg_resptime_points, percentile_80_resptime_points, percentile_90_resptime_points, 'All_Transactions_response_times_intervals.png', results_dir)
+    avg_resptime_points, percentile_80_resptime_points, percentile_90_resptime_points = \
+        write_interval_table(report, intervals, interval_secs)
+    graphs.resp_graph(avg_resptime_points, percentile_80_resptime_points, percentile_90_resptime_points, 'All_Transactions_response_times_intervals.png', results_dir)
 
 
     report.write_line('<h3>Graphs</h3>')
     report.write_line('<h4>Response Time: %s sec time-series</h4>' % ts_interval)
-    report.write_line('<img src="All_Transactions_response_times_intervals.png"></img>')
-    report.write_line('<h4>Response Time: raw data (all points)</h4>')
-    report.write_line('<img src="All_Transactions_response_times.png"></img>')
+    report.write_line(graphs.html('All_Transactions_response_times_intervals.png'))
+    report.write_line('<h4>Response Time: raw data (%s)</h4>' % raw_description)
+    report.write_line(graphs.html('All_Transactions_response_times.png'))
     report.write_line('<h4>Throughput: 5 sec time-series</h4>')
-    report.write_line('<img src="All_Transactions_throughput.png"></img>')
+    report.write_line(graphs.html('All_Transactions_throughput.png'))
 
 
 
     # all transactions - throughput
-    throughput_points = {}  # {intervalnumber: numberofrequests}
-    interval_secs = ts_interval
-    splat_series=None
-    try:
-        splat_series = split_series(trans_timer_points, interval_secs)
-    except:
-        #traceback.print_exc()
-        pass
-
-    for i, bucket in enumerate(splat_series):
-        throughput_points[int((i + 1) * interval_secs)] = (len(bucket) / interval_secs)
-    graph.tp_graph(throughput_points, 'All_Transactions_throughput.png', results_dir)
+    graphs.tp_graph(throughput_points(intervals, interval_secs), 'All_Transactions_throughput.png', results_dir)
 
 
 
@@ -148,89 +145,43 @@ def output_results(results_dir, results_file, run_time, rampup, ts_interval, use
         if timer_name == DEBUG_TIMERNAME:
             foo=timer_name
 
-        custom_timer_vals = []
-        custom_timer_points = []
-        for resp_stats in results.resp_stats_list:
-            try:
-                val = resp_stats.custom_timers[timer_name]
-                custom_timer_points.append((resp_stats.elapsed_time, val))
-                custom_timer_vals.append(val)
-            except KeyError:
-                #traceback.print_exc()
-                pass
-
+        # each timer writes to its own section, placed in timer name order
+        section = report.section()
         try:
 
-            graph.resp_graph_raw(custom_timer_points, timer_name + '_response_times.png', results_dir)
+            points = analysis.points(timer_name)
+            raw_description = raw_points_description(graphs, analysis, points, timer_name)
+            graphs.resp_graph_raw(points, timer_name + '_response_times.png', results_dir)
 
-            throughput_points = {}  # {intervalnumber: numberofrequests}
             interval_secs = ts_interval
-            splat_series = split_series(custom_timer_points, interval_secs)
-            for i, bucket in enumerate(splat_series):
-                throughput_points[int((i + 1) * interval_secs)] = (len(bucket) / interval_secs)
-            graph.tp_graph(throughput_points, timer_name + '_throughput.png', results_dir)
-
-            report.write_line('<hr />')
-            report.write_line('<h2>Custom Timer: %s</h2>' % timer_name)
-
-            report.write_line('<h3>Timer Summary (secs)</h3>')
-
-            report.write_line('<table>')
-            report.write_line('<tr><th>count</th><th>min</th><th>avg</th><th>80pct</th><th>90pct</th><th>95pct</th><th>max</th><th>stdev</th></tr>')
-            report.write_line('<tr><td>%i</td><td>%.3f</td><td>%.3f</td><td>%.3f</td><td>%.3f</td><td>%.3f</td><td>%.3f</td><td>%.3f</td></tr>'  % (
-                len(custom_timer_vals),
-                min(custom_timer_vals),
-                average(custom_timer_vals),
-                percentile(custom_timer_vals, 80),
-                percentile(custom_timer_vals, 90),
-                percentile(custom_timer_vals, 95),
-                max(custom_timer_vals),
-                standard_dev(custom_timer_vals)
-            ))
-            report.write_line('</table>')
+            if histograms is not None:
+                summary = histograms.timers[timer_name].total.stats()
+                intervals = histograms.timers[timer_name].interval_stats()
+            else:
+                summary, intervals = analysis.stats(timer_name)
+
+            graphs.tp_graph(throughput_points(intervals, interval_secs), timer_name + '_throughput.png', results_dir)
+
+            section.write_line('<hr />')
+            section.write_line('<h2>Custom Timer: %s</h2>' % timer_name)
+
+            section.write_line('<h3>Timer Summary (secs)</h3>')
+            write_summary_table(section, summary)
 
 
             # custom timers - interval details
-            avg_resptime_points = {}  # {intervalnumber: avg_resptime}
-            percentile_80_resptime_points = {}  # {intervalnumber: 80pct_resptime}
-            percentile_90_resptime_points = {}  # {intervalnumber: 90pct_resptime}
-            interval_secs = ts_interval
-            splat_series = split_series(custom_timer_points, interval_secs)
-            report.write_line('<h3>Interval Details (secs)</h3>')
-            report.write_line('<table>')
-            report.write_line('<tr><th>interval</th><th>count</th><th>rate</th><th>min</th><th>avg</th><th>80pct</th><th>90pct</th><th>95pct</th><th>max</th><th>stdev</th></tr>')
-            for i, bucket in enumerate(splat_series):
-                interval_start = int((i + 1) * interval_secs)
-                cnt = len(bucket)
-
-                if cnt == 0:
-                    report.write_line('<tr><td>%i</td><td>0</td><td>0</td><td>N/A</td><td>N/A</td><td>N/A</td><td>N/A</td><td>N/A</td><td>N/A</td><td>N/A</td></tr>' % (i + 1))
-                else:
-                    rate = cnt / float(interval_secs)
-                    mn = min(bucket)
-                    avg = average(bucket)
-                    pct_80 = percentile(bucket, 80)
-                    pct_90 = percentile(bucket, 90)
-                    pct_95 = percentile(bucket, 95)
-                    mx = max(bucket)
-                    stdev = standard_dev(bucket)
-
-                    report.write_line('<tr><td>%i</td><td>%i</td><td>%.2f</td><td>%.3f</td><td>%.3f</td><td>%.3f</td><td>%.3f</td><td>%.3f</td><td>%.3f</td><td>%.3f</td></tr>' % (i + 1, cnt, rate, mn, avg, pct_80, pct_90, pct_95, mx, stdev))
-
-                    avg_resptime_points[interval_start] = avg
-                    percentile_80_resptime_points[interval_start] = pct_80
-                    percentile_90_resptime_points[interval_start] = pct_90
-            report.write_line('</table>')
-            graph.resp_graph(avg_resptime_points, percentile_80_resptime_points, percentile_90_resptime_points, timer_name + '_response_times_intervals.png', results_dir)
-
-
-            report.write_line('<h3>Graphs</h3>')
-            report.write_line('<h4>Response Time: %s sec time-series</h4>' % ts_interval)
-            report.write_line('<img src="%s_response_times_intervals.png"></img>' % timer_name)
-            report.write_line('<h4>Response Time: raw data (all points)</h4>')
-            report.write_line('<img src="%s_response_times.png"></img>' % timer_name)
-            report.write_line('<h4>Throughput: %s sec time-series</h4>' % ts_interval)
-            report.write_line('<img src="%s_throughput.png"></img>' % timer_name)
+            avg_resptime_points, percentile_80_resptime_points, percentile_90_resptime_points = \
+                write_interval_table(section, intervals, interval_secs)
+            graphs.resp_graph(avg_resptime_points, percentile_80_resptime_points, percentile_90_resptime_points, timer_name + '_response_times_intervals.png', results_dir)
+
+
+            section.write_line('<h3>Graphs</h3>')
+            section.write_line('<h4>Response Time: %s sec time-series</h4>' % ts_interval)
+            section.write_line(graphs.html(timer_name + '_response_times_intervals.png'))
+            section.write_line('<h4>Response Time: raw data (%s)</h4>' % raw_description)
+            section.write_line(graphs.html(timer_name + '_response_times.png'))
+            section.write_line('<h4>Throughput: %s sec time-series</h4>' % ts_interval)
+            section.write_line(graphs.html(timer_name + '_throughput.png'))
         except:
             traceback.print_exc()
             pass
@@ -252,77 +203,693 @@ def output_results(results_dir, results_file, run_time, rampup, ts_interval, use
     #    print ''
 
     report.write_line('<hr />')
+    footer = graphs.footer()
+    if footer:
+        report.write_line(footer)
     report.write_closing_html()
 
+    graph_count, graph_secs = graphs.finish()
+    print 'graphs: %d rendered in %.1f secs\n' % (graph_count, graph_secs)
+
+
+
+def graph_renderer(report_graphs, processes):
+    """
+    :returns: what draws the report graphs: a graph.GraphRenderer for png
+              images, a reportcharts.ChartCollector for interactive graphs.
+    """
+    if report_graphs == 'interactive':
+        return reportcharts.ChartCollector()
+    import graph  # only png graphs need matplotlib
+    return graph.GraphRenderer(processes)
+
+
+
+def raw_points_description(graphs, analysis, points, timer_name=None):
+    """heading of a raw data graph of points, which may be a sample of the series."""
+    description = graphs.raw_description(len(points))
+    count = analysis.point_count(timer_name)
+    if count > len(points):
+        sample = 'random sample of %d of %d points' % (len(points), count)
+        if description == 'all points':
+            return sample
+        return '%s; %s' % (sample, description)
+    return description
+
+
+
+def load_histograms(results_dir, run_time, ts_interval):
+    """
+    load the histograms the results writer saved during the run.
+    :returns: None, if there are none or they were made for a different
+              run time or time-series interval.
+    """
+    file_name = results_dir + histogram.HISTOGRAMS_FILE
+    if not os.path.exists(file_name):
+        return None
+    try:
+        histograms = histogram.ResultsHistograms.load(file_name)
+    except (IOError, ValueError, KeyError):
+        traceback.print_exc()
+        return None
+    if histograms.run_time != run_time or histograms.interval != ts_interval:
+        return None
+    return histograms
+
+
+
+def analysis_backend(results, ts_interval):
+    """
+    :returns: NumpyAnalysis of the results if numpy is installed,
+              PythonAnalysis otherwise.
+    """
+    if numpy is not None:
+        return NumpyAnalysis(results, ts_interval)
+    return PythonAnalysis(results, ts_interval)
+
+
+
+class PythonAnalysis(object):
+    """
+    computes the report statistics of Results with plain python lists.
+    a series is all transactions (timer_name None) or one custom timer.
+    """
+
+    def __init__(self, results, interval):
+        self.results = results
+        self.interval = interval
+        self.cached_points = (False, None)
+
+    def points(self, timer_name=None):
+        """:returns: [(elapsed, value)] of a series, in file order"""
+        if self.cached_points[0] is not False and self.cached_points[0] == timer_name:
+            return self.cached_points[1]
+        if timer_name is None:
+            points = zip(self.results.columns.elapsed, self.results.columns.trans_time)
+        else:
+            points = zip(*self.results.timer_points(timer_name))
+        self.cached_points = (timer_name, points)
+        return points
+
+    def point_count(self, timer_name=None):
+        """:returns: number of points of a series (all of them are in points())"""
+        return len(self.points(timer_name))
+
+    def stats(self, timer_name=None):
+        """:returns: (summary_stats() tuple, interval_stats() list) of a series"""
+        points = self.points(timer_name)
+        vals = [val for elapsed, val in points]
+        return summary_stats(vals), interval_stats(points, self.interval)
+
+
+
+class NumpyAnalysis(object):
+    """
+    columnar version of PythonAnalysis.  the results are loaded once into
+    arrays (elapsed time, duration and group id per transaction; elapsed
+    time and value per custom timer) and every statistic is computed with
+    vectorized operations over sorted arrays.
+    """
+
+    percentiles = (80, 90, 95)
+
+    def __init__(self, results, interval):
+        self.interval = interval
+        columns = results.columns
+        self.results = results
+        self.user_group_names = sorted(results.uniq_user_group_names)
+        group_ids = dict((name, i) for i, name in enumerate(self.user_group_names))
+
+        # the columns are used in place, without copying
+        self.elapsed = numpy.frombuffer(columns.elapsed, dtype=numpy.float64)
+        self.trans_time = numpy.frombuffer(columns.trans_time, dtype=numpy.float64)
+        group_id_map = numpy.array([group_ids[name] for name in columns.group_names] or [0], dtype=numpy.int32)
+        self.group_id = group_id_map[numpy.frombuffer(columns.group_id, dtype=numpy.intc)]
+
+    def series(self, timer_name=None):
+        """:returns: (elapsed array, value array) of a series, in file order"""
+        if timer_name is None:
+            return self.elapsed, self.trans_time
+        elapsed, vals = self.results.timer_points(timer_name)
+        return (numpy.frombuffer(elapsed, dtype=numpy.float64),
+                numpy.frombuffer(vals, dtype=numpy.float64))
+
+    def points(self, timer_name=None):
+        """
+        :returns: (n, 2) array of the (elapsed, value) points of a series, in
+                  file order; it pickles as one buffer for the graph processes.
+        """
+        elapsed, vals = self.series(timer_name)
+        return numpy.column_stack((elapsed, vals))
+
+    def point_count(self, timer_name=None):
+        return len(self.series(timer_name)[0])
+
+    def stats(self, timer_name=None):
+        elapsed, vals = self.series(timer_name)
+        return self.summary_stats(vals), self.interval_stats(elapsed, vals)
+
+    def summary_stats(self, vals):
+        count = len(vals)
+        sorted_vals = numpy.sort(vals)
+        pcts = [float(sorted_vals[int(count * (pct / 100.0))]) for pct in self.percentiles]
+        stdev = 0
+        if count > 1:
+            stdev = float(sorted_vals.std(ddof=1))
+        return tuple([count, float(sorted_vals[0]), float(sorted_vals.mean())] + pcts +
+                     [float(sorted_vals[-1]), stdev])
+
+    def interval_stats(self, elapsed, vals):
+        """same buckets as split_series(): counted from the first point, covering all points."""
+        if not len(elapsed):
+            return []
+        buckets = numpy.floor_divide(elapsed - elapsed[0], self.interval).astype(numpy.int64)
+        first = int(buckets.min())
+        if first:
+            buckets -= first
+        last = int(buckets.max())
+        # one sort orders the values by bucket, then by value
+        order = numpy.lexsort((vals, buckets))
+        sorted_vals = vals[order]
+        counts = numpy.bincount(buckets, minlength=last + 1)
+        starts = numpy.cumsum(counts) - counts
+        filled = numpy.maximum(counts, 1)
+        avgs = numpy.bincount(buckets, weights=vals, minlength=last + 1) / filled
+        deviations = vals - avgs[buckets]
+        sdsq = numpy.bincount(buckets, weights=deviations * deviations, minlength=last + 1)
+        stdevs = numpy.where(counts > 1, numpy.sqrt(sdsq / numpy.maximum(counts - 1, 1)), 0)
+        mins = sorted_vals[numpy.minimum(starts, len(sorted_vals) - 1)]
+        maxs = sorted_vals[numpy.minimum(starts + filled - 1, len(sorted_vals) - 1)]
+        pcts = [sorted_vals[numpy.minimum(starts + (counts * (pct / 100.0)).astype(numpy.int64),
+                                          len(sorted_vals) - 1)]
+                for pct in self.percentiles]
+        columns = [counts, mins, avgs] + pcts + [maxs, stdevs]
+        series = []
+        for i, row in enumerate(zip(*[column.tolist() for column in columns])):
+            if counts[i] == 0:
+                series.append(None)
+            else:
+                series.append(row)
+        return series
+
+
+
+def write_summary_table(report, summary):
+    report.write_line('<table>')
+    report.write_line('<tr><th>count</th><th>min</th><th>avg</th><th>80pct</th><th>90pct</th><th>95pct</th><th>max</th><th>stdev</th></tr>')
+    report.write_line('<tr><td>%i</td><td>%.3f</td><td>%.3f</td><td>%.3f</td><td>%.3f</td><td>%.3f</td><td>%.3f</td><td>%.3f</td></tr>' % summary)
+    report.write_line('</table>')
+
+
+
+def write_interval_table(report, intervals, interval_secs):
+    """
+    :returns: avg, 80pct and 90pct response time points for the graphs,
+              each as {interval start: value}
+    """
+    avg_resptime_points = {}  # {intervalnumber: avg_resptime}
+    percentile_80_resptime_points = {}  # {intervalnumber: 80pct_resptime}
+    percentile_90_resptime_points = {}  # {intervalnumber: 90pct_resptime}
+    report.write_line('<h3>Interval Details (secs)</h3>')
+    report.write_line('<table>')
+    report.write_line('<tr><th>interval</th><th>count</th><th>rate</th><th>min</th><th>avg</th><th>80pct</th><th>90pct</th><th>95pct</th><th>max</th><th>stdev</th></tr>')
+    for i, stats in enumerate(intervals):
+        interval_start = int((i + 1) * interval_secs)
+
+        if stats is None:
+            report.write_line('<tr><td>%i</td><td>0</td><td>0</td><td>N/A</td><td>N/A</td><td>N/A</td><td>N/A</td><td>N/A</td><td>N/A</td><td>N/A</td></tr>' % (i + 1))
+        else:
+            cnt, mn, avg, pct_80, pct_90, pct_95, mx, stdev = stats
+            rate = cnt / float(interval_secs)
+            report.write_line('<tr><td>%i</td><td>%i</td><td>%.2f</td><td>%.3f</td><td>%.3f</td><td>%.3f</td><td>%.3f</td><td>%.3f</td><td>%.3f</td><td>%.3f</td></tr>' % (i + 1, cnt, rate, mn, avg, pct_80, pct_90, pct_95, mx, stdev))
+
+            avg_resptime_points[interval_start] = avg
+            percentile_80_resptime_points[interval_start] = pct_80
+            percentile_90_resptime_points[interval_start] = pct_90
+    report.write_line('</table>')
+    return avg_resptime_points, percentile_80_resptime_points, percentile_90_resptime_points
+
+
+
+def throughput_points(intervals, interval_secs):
+    """:returns: {interval start: transactions per second}"""
+    points = {}
+    for i, stats in enumerate(intervals):
+        cnt = 0
+        if stats is not None:
+            cnt = stats[0]
+        points[int((i + 1) * interval_secs)] = (cnt / interval_secs)
+    return points
+
 
 
 
 class Results(object):
-    def __init__(self, results_file_name, run_time):
+    """
+    the records of a results file that fall within the run time, held in
+    ResultColumns.  resp_stats_list gives ResponseStats views of them,
+    created on access.  with cache set, the parsed columns are saved to
+    (and later loaded from) a resultscache file next to the results file.
+    """
+
+    def __init__(self, results_file_name, run_time, processes=1, cache=False, reader=None):
         self.results_file_name = results_file_name
         self.run_time = run_time
+        self.processes = processes
+        self.reader = reader or resultsfile.read_results
         self.total_transactions = 0
         self.total_errors = 0
         self.uniq_timer_names = set()
         self.uniq_user_group_names = set()
+        self.timer_series = None  # {timer name: (elapsed array, value array)}, built on first use
+
+        self.columns = None
+        if cache:
+            self.columns = self.__load_cache()
+        if self.columns is None:
+            self.columns = self.__parse_file()
+            if cache:
+                self.__save_cache()
+        self.resp_stats_list = ResponseStatsList(self.columns)
+
+        self.epoch_start = min(self.columns.epoch)
+        self.epoch_finish = max(self.columns.epoch)
+        self.start_datetime = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.epoch_start))
+        self.finish_datetime = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.epoch_finish))
+
+
+
+    def timer_points(self, timer_name):
+        """:returns: (elapsed array, value array) of a custom timer, in file order"""
+        if self.timer_series is None:
+            self.timer_series = self.columns.timer_series()
+        try:
+            return self.timer_series[timer_name]
+        except KeyError:
+            return array.array('d'), array.array('d')
+
+
+
+    def __load_cache(self):
+        columns = ResultColumns()
+        try:
+            reader_key = getattr(self.reader, 'cache_key', None)
+            source = resultscache.source_info(self.results_file_name, self.run_time, reader_key)
+            totals = resultscache.load(resultscache.cache_file_name(self.results_file_name, reader_key), source, columns)
+        except Exception:
+            traceback.print_exc()
+            return None
+        if totals is None:
+            return None
+        self.total_transactions = totals['total_transactions']
+        self.total_errors = totals['total_errors']
+        self.uniq_user_group_names = set(totals['uniq_user_group_names'])
+        self.uniq_timer_names = set(totals['uniq_timer_names'])
+        return columns
+
+
+
+    def __save_cache(self):
+        totals = {
+            'total_transactions': self.total_transactions,
+            'total_errors': self.total_errors,
+            'uniq_user_group_names': self.uniq_user_group_names,
+            'uniq_timer_names': self.uniq_timer_names,
+        }
+        try:
+            reader_key = getattr(self.reader, 'cache_key', None)
+            source = resultscache.source_info(self.results_file_name, self.run_time, reader_key)
+            resultscache.save(resultscache.cache_file_name(self.results_file_name, reader_key), source, self.columns, totals)
+        except (IOError, OSError):
+            traceback.print_exc()
+
+
+
+    def __parse_file(self):
+        if (self.processes > 1 and self.reader is resultsfile.read_results and
+                not resultsfile.is_binary(self.results_file_name) and
+                os.path.getsize(self.results_file_name) >= PARALLEL_MIN_SIZE):
+            chunks = read_csv_parallel(self.results_file_name, self.run_time, self.processes)
+        else:
+            chunks = [parse_records(self.reader(self.results_file_name), self.run_time)]
+
+        columns = None
+        for chunk_columns, total_transactions, total_errors, user_group_names, timer_names in chunks:
+            if columns is None:
+                columns = chunk_columns
+            else:
+                columns.concat(chunk_columns)
+            self.total_transactions += total_transactions
+            self.total_errors += total_errors
+            self.uniq_user_group_names.update(user_group_names)
+            self.uniq_timer_names.update(timer_names)
+        return columns
+
+
+
+def parse_records(records, run_time):
+    """
+    :returns: (ResultColumns of the records before run_time, total transactions,
+               total errors, user group names, timer names) of a stream of records.
+              the totals and names include the records past run_time.
+    """
+    counts = [0, 0]  # transactions, errors
+    user_group_names = set()
+    timer_names = set()
+
+    def kept_records():
+        for record in records:
+            counts[0] += 1
+            if record[5] != '':
+                counts[1] += 1
+            user_group_names.add(record[3])
+            timer_names.update(record[6])
+            if record[1] < run_time:  # drop all times that appear after the last request was sent (incomplete interval)
+                yield record
+
+    columns = ResultColumns()
+    columns.extend(kept_records())
+    return columns, counts[0], counts[1], user_group_names, timer_names
+
+
+
+def read_csv_parallel(file_name, run_time, processes):
+    """
+    parse byte ranges of a results.csv file in a pool of processes.
+    yields the parse_records() result of each range, in file order.
+    """
+    ranges = resultsfile.split_csv(file_name, processes * 4)
+    pool = multiprocessing.Pool(processes)
+    try:
+        for chunk in pool.imap(_parse_csv_range, [(file_name, start, end, run_time) for start, end in ranges]):
+            yield chunk
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+
+def _parse_csv_range((file_name, start, end, run_time)):
+    return parse_records(resultsfile.read_csv_range(file_name, start, end), run_time)
+
+
+
+class ResultColumns(object):
+    """
+    results records stored column-wise in typed arrays, which take a
+    fraction of the memory of ResponseStats objects and pickle quickly.
+    user group names, errors and timer names are interned to ids.  custom
+    timers are stored in compressed sparse rows: the timers of record i
+    are timer_ids[j] / timer_values[j] for j in
+    xrange(timer_offsets[i], timer_offsets[i + 1]).  missing start and
+    finish stamps are stored as 0.
+    """
+
+    def __init__(self):
+        self.request_num = array.array('l')
+        self.elapsed = array.array('d')
+        self.epoch = array.array('l')
+        self.group_id = array.array('i')
+        self.trans_time = array.array('d')
+        self.error_id = array.array('i')
+        self.start_ns = array.array(NS_TYPECODE)
+        self.finish_ns = array.array(NS_TYPECODE)
+        self.timer_offsets = array.array('l', [0])
+        self.timer_ids = array.array('i')
+        self.timer_values = array.array('d')
+        self.group_names = []
+        self.errors = ['']
+        self.timer_names = []
+        self.ids = ({}, {'': 0}, {})  # group, error and timer name ids
+
+    def __len__(self):
+        return len(self.request_num)
+
+    def intern(self, kind, names, name):
+        ids = self.ids[kind]
+        name_id = ids.get(name)
+        if name_id is None:
+            name_id = ids[name] = len(names)
+            names.append(name)
+        return name_id
+
+    def append(self, request_num, elapsed, epoch, user_group_name, trans_time, error, custom_timers,
+               start_ns=None, finish_ns=None):
+        self.request_num.append(request_num)
+        self.elapsed.append(elapsed)
+        self.epoch.append(epoch)
+        self.group_id.append(self.intern(0, self.group_names, user_group_name))
+        self.trans_time.append(trans_time)
+        self.error_id.append(self.intern(1, self.errors, error))
+        self.start_ns.append(start_ns or 0)
+        self.finish_ns.append(finish_ns or 0)
+        for timer_name, value in custom_timers.iteritems():
+            self.timer_ids.append(self.intern(2, self.timer_names, timer_name))
+            self.timer_values.append(value)
+        self.timer_offsets.append(len(self.timer_ids))
+
+    def extend(self, records):
+        """append many records; same as append() for each, with the lookups hoisted out of the loop."""
+        group_ids, error_ids, timer_ids = self.ids
+        group_names, errors, timer_names = self.group_names, self.errors, self.timer_names
+        append_request_num = self.request_num.append
+        append_elapsed = self.elapsed.append
+        append_epoch = self.epoch.append
+        append_group_id = self.group_id.append
+        append_trans_time = self.trans_time.append
+        append_error_id = self.error_id.append
+        append_start_ns = self.start_ns.append
+        append_finish_ns = self.finish_ns.append
+        append_timer_offset = self.timer_offsets.append
+        append_timer_id = self.timer_ids.append
+        append_timer_value = self.timer_values.append
+        timer_count = len(self.timer_ids)
+        for (request_num, elapsed, epoch, user_group_name, trans_time, error, custom_timers,
+             start_ns, finish_ns) in records:
+            append_request_num(request_num)
+            append_elapsed(elapsed)
+            append_epoch(epoch)
+            group_id = group_ids.get(user_group_name)
+            if group_id is None:
+                group_id = self.intern(0, group_names, user_group_name)
+            append_group_id(group_id)
+            append_trans_time(trans_time)
+            error_id = error_ids.get(error)
+            if error_id is None:
+                error_id = self.intern(1, errors, error)
+            append_error_id(error_id)
+            append_start_ns(start_ns or 0)
+            append_finish_ns(finish_ns or 0)
+            for timer_name, value in custom_timers.iteritems():
+                timer_id = timer_ids.get(timer_name)
+                if timer_id is None:
+                    timer_id = self.intern(2, timer_names, timer_name)
+                append_timer_id(timer_id)
+                append_timer_value(value)
+            timer_count += len(custom_timers)
+            append_timer_offset(timer_count)
+
+    def concat(self, other):
+        """append the records of another ResultColumns, translating its name ids."""
+        group_map = [self.intern(0, self.group_names, name) for name in other.group_names]
+        error_map = [self.intern(1, self.errors, error) for error in other.errors]
+        timer_map = [self.intern(2, self.timer_names, name) for name in other.timer_names]
+        self.request_num.extend(other.request_num)
+        self.elapsed.extend(other.elapsed)
+        self.epoch.extend(other.epoch)
+        self.group_id.extend(_translate(other.group_id, group_map))
+        self.trans_time.extend(other.trans_time)
+        self.error_id.extend(_translate(other.error_id, error_map))
+        self.start_ns.extend(other.start_ns)
+        self.finish_ns.extend(other.finish_ns)
+        timer_count = self.timer_offsets[-1]
+        if timer_count:
+            self.timer_offsets.extend(array.array('l', [offset + timer_count for offset in other.timer_offsets[1:]]))
+        else:
+            self.timer_offsets.extend(other.timer_offsets[1:])
+        self.timer_ids.extend(_translate(other.timer_ids, timer_map))
+        self.timer_values.extend(other.timer_values)
+
+    def timer_series(self):
+        """:returns: {timer name: (elapsed array, value array)}, in record order"""
+        series = [(array.array('d'), array.array('d')) for timer_name in self.timer_names]
+        elapsed = self.elapsed
+        timer_offsets = self.timer_offsets
+        timer_ids = self.timer_ids
+        timer_values = self.timer_values
+        j = 0
+        for i in xrange(len(self)):
+            end = timer_offsets[i + 1]
+            while j < end:
+                elapsed_vals, vals = series[timer_ids[j]]
+                elapsed_vals.append(elapsed[i])
+                vals.append(timer_values[j])
+                j += 1
+        return dict(zip(self.timer_names, series))
+
+    def custom_timers(self, i):
+        timer_names = self.timer_names
+        timer_ids = self.timer_ids
+        timer_values = self.timer_values
+        custom_timers = {}
+        for j in xrange(self.timer_offsets[i], self.timer_offsets[i + 1]):
+            custom_timers[timer_names[timer_ids[j]]] = timer_values[j]
+        return custom_timers
+
+    def record(self, i):
+        """record i as a tuple, in the order resultsfile.read_results() yields them."""
+        return (self.request_num[i], self.elapsed[i], self.epoch[i], self.group_names[self.group_id[i]],
+                self.trans_time[i], self.errors[self.error_id[i]], self.custom_timers(i),
+                int(self.start_ns[i]) or None, int(self.finish_ns[i]) or None)
+
+    def records(self):
+        for i in xrange(len(self)):
+            yield self.record(i)
+
+
+
+def _translate(ids, id_map):
+    if id_map == range(len(id_map)):
+        return ids
+    return array.array(ids.typecode, [id_map[i] for i in ids])
+
+
+
+class ResponseStatsList(object):
+    """read-only sequence of ResponseStats views of the records in ResultColumns."""
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.columns)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in xrange(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('list index out of range')
+        return ResponseStats(*self.columns.record(index))
+
+    def __iter__(self):
+        for record in self.columns.records():
+            yield ResponseStats(*record)
+
+
+
+class StreamingResults(object):
+    """
+    out-of-core alternative to Results for results files too big to hold in
+    memory.  the file is read once, record by record; each record is
+    folded into a ResultsHistograms (per-interval summaries) and into
+    fixed-size random samples of the raw points, so memory use depends on
+    the number of intervals and sample_size, not on the size of the file.
+    """
+
+    def __init__(self, results_file_name, run_time, interval, sample_size=10000, significant_digits=3,
+                 reader=None):
+        self.results_file_name = results_file_name
+        self.reader = reader or resultsfile.read_results
+        self.run_time = run_time
+        self.sample_size = sample_size
+        self.uniq_timer_names = set()
+        self.uniq_user_group_names = set()
+        self.histograms = histogram.ResultsHistograms(run_time, interval, significant_digits)
+        self.samples = {}  # {timer name (None for all transactions): Reservoir}
+        self.random = random.Random(0)  # same samples, and graphs, on every analysis
 
-        self.resp_stats_list = self.__parse_file()
+        self.__parse_file()
 
-        self.epoch_start = self.resp_stats_list[0].epoch_secs
-        self.epoch_finish = self.resp_stats_list[-1].epoch_secs
+        self.total_transactions = self.histograms.total_transactions
+        self.total_errors = self.histograms.total_errors
+        self.epoch_start = self.histograms.epoch_start
+        self.epoch_finish = self.histograms.epoch_finish
         self.start_datetime = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.epoch_start))
         self.finish_datetime = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.epoch_finish))
 
 
 
-    def __parse_file(self):
-        f = open(self.results_file_name, 'rb')
-        resp_stats_list = []
-        for line in f:
-            fields = line.strip().split(',')
-
-            request_num = int(fields[0])
-            elapsed_time = float(fields[1])
-            epoch_secs = int(fields[2])
-            user_group_name = fields[3]
-            trans_time = float(fields[4])
-            error = fields[5]
+    def points(self, timer_name=None):
+        """:returns: [(elapsed, value)] sample of a series, in file order"""
+        try:
+            return self.samples[timer_name].points()
+        except KeyError:
+            return []
+
+
+
+    def point_count(self, timer_name=None):
+        """:returns: number of points of a series, of which points() is a sample"""
+        try:
+            return self.samples[timer_name].seen
+        except KeyError:
+            return 0
 
+
+
+    def iter_resp_stats(self):
+        """yields a ResponseStats for each record within the run time, reading the file again."""
+        for record in self.reader(self.results_file_name):
+            if record[1] < self.run_time:
+                yield ResponseStats(*record)
+
+
+
+    def sample(self, timer_name, elapsed_time, val):
+        reservoir = self.samples.get(timer_name)
+        if reservoir is None:
+            reservoir = self.samples[timer_name] = Reservoir(self.sample_size, self.random)
+        reservoir.add(elapsed_time, val)
+
+
+
+    def __parse_file(self):
+        records = self.reader(self.results_file_name)
+        record_histograms = self.histograms.record
+        for (request_num, elapsed_time, epoch_secs, user_group_name, trans_time, error, custom_timers,
+             start_ns, finish_ns) in records:
             self.uniq_user_group_names.add(user_group_name)
+            self.uniq_timer_names.update(custom_timers)
+            record_histograms(elapsed_time, epoch_secs, user_group_name, trans_time, error, custom_timers)
+            if elapsed_time < self.run_time:
+                self.sample(None, elapsed_time, trans_time)
+                for timer, val in custom_timers.iteritems():
+                    self.sample(timer, elapsed_time, val)
 
-            custom_timers = {}
-            timers_string = ''.join(fields[6:]).replace('{', '').replace('}', '')
-            splat = timers_string.split("'")[1:]
-            timers = []
-            vals = []
-            for x in splat:
-                if ':' in x:
-                    x = float(x.replace(': ', ''))
-                    vals.append(x)
-                else:
-                    timers.append(x)
-                    self.uniq_timer_names.add(x)
-            for timer, val in zip(timers, vals):
-                custom_timers[timer] = val
 
-            #if re.search( DEBUG_TIMERNAME, custom_timers.keys().pop() ):
-            #    foo="debug"
-            r = ResponseStats(request_num, elapsed_time, epoch_secs, user_group_name, trans_time, error, custom_timers)
 
-            if elapsed_time < self.run_time:  # drop all times that appear after the last request was sent (incomplete interval)
-                resp_stats_list.append(r)
+class Reservoir(object):
+    """uniform random sample of at most size (elapsed, value) points of a stream (algorithm R)."""
 
-            if error != '':
-                self.total_errors += 1
+    def __init__(self, size, rng):
+        self.size = size
+        self.random = rng
+        self.seen = 0
+        self.items = []  # [(position in stream, elapsed, value)]
 
-            self.total_transactions += 1
+    def add(self, elapsed, value):
+        self.seen += 1
+        if len(self.items) < self.size:
+            self.items.append((self.seen, elapsed, value))
+        else:
+            i = self.random.randrange(self.seen)
+            if i < self.size:
+                self.items[i] = (self.seen, elapsed, value)
 
-        return resp_stats_list
+    def points(self):
+        return [(elapsed, value) for position, elapsed, value in sorted(self.items)]
 
 
 
 class ResponseStats(object):
-    def __init__(self, request_num, elapsed_time, epoch_secs, user_group_name, trans_time, error, custom_timers):
+    __slots__ = ('request_num', 'elapsed_time', 'epoch_secs', 'user_group_name', 'trans_time', 'error',
+                 'custom_timers', 'start_ns', 'finish_ns')
+
+    def __init__(self, request_num, elapsed_time, epoch_secs, user_group_name, trans_time, error, custom_timers,
+                 start_ns=None, finish_ns=None):
         self.request_num = request_num
         self.elapsed_time = elapsed_time
         self.epoch_secs = epoch_secs
@@ -330,17 +897,20 @@ class ResponseStats(object):
         self.trans_time = trans_time
         self.error = error
         self.custom_timers = custom_timers
+        self.start_ns = start_ns
+        self.finish_ns = finish_ns
 
 
 
 def split_series(points, interval):
     try:
+        # intervals are counted from the first point, and cover the points
+        # before it too (files of other tools are not in time order)
         offset = points[0][0]
-        maxval = int((points[-1][0] - offset) // interval)
         vals = defaultdict(list)
         for key, value in points:
-            vals[(key - offset) // interval].append(value)
-        series = [vals[i] for i in xrange(maxval + 1)]
+            vals[int((key - offset) // interval)].append(value)
+        series = [vals[i] for i in xrange(min(vals), max(vals) + 1)]
         return series
     except:
         #traceback.print_exc()
@@ -348,6 +918,33 @@ def split_series(points, interval):
         return None
 
 
+def summary_stats(seq):
+    """:returns: (count, min, avg, 80pct, 90pct, 95pct, max, stdev) of a sequence of timings."""
+    return (
+        len(seq),
+        min(seq),
+        average(seq),
+        percentile(seq, 80),
+        percentile(seq, 90),
+        percentile(seq, 95),
+        max(seq),
+        standard_dev(seq),
+    )
+
+
+
+def interval_stats(points, interval):
+    """
+    :returns: summary_stats() of each time-series interval of (elapsed, value)
+              points, None for intervals without points.
+    """
+    splat_series = split_series(points, interval)
+    if splat_series is None:
+        return []
+    return [bucket and summary_stats(bucket) or None for bucket in splat_series]
+
+
+
 def average(seq):
     avg = (float(sum(seq)) / len(seq))
     return avg
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+#
+#  Copyright (c) 2010-2012 Corey Goldberg (corey@goldb.org)
+#  License: GNU LGPLv3
+#
+#  This file is part of Multi-Mechanize | Performance Test Framework
+#
+
+"""
+cache of parsed results, saved next to the results file, so analyzing the
+same results again (e.g. multimech-run -r with a different time-series
+interval) does not parse the results file again.
+
+the cache file holds a json header (where the cache came from, the
+totals and the interned names) followed by the raw bytes of each column
+array, 8 byte aligned.  json, not pickle: a cache found in a results
+directory must not be able to run code when it is loaded.  it is valid while the results file has the same
+size, modification time and hash of its first and last megabyte, and the
+run time and (for files of other tools) the importer and its options are
+unchanged.
+"""
+
+import hashlib
+import json
+import os
+import struct
+import sys
+
+
+CACHE_FILE = 'results.cache'
+MAGIC = 'MMRC\x02'
+HEADER_SIZE = struct.Struct('<Q')
+HASH_BLOCK_SIZE = 1024 * 1024
+
+COLUMNS = ('request_num', 'elapsed', 'epoch', 'group_id', 'trans_time', 'error_id', 'start_ns', 'finish_ns',
+           'timer_offsets', 'timer_ids', 'timer_values')
+
+
+
+def cache_file_name(results_file_name, reader_key=None):
+    """results.cache for a results file; <file name>.cache for a file read by an importer."""
+    if reader_key is not None:
+        return results_file_name + '.cache'
+    return os.path.join(os.path.dirname(results_file_name), CACHE_FILE)
+
+
+
+def source_info(results_file_name, run_time, reader_key=None):
+    """
+    what a cache of a results file must match to be valid.
+    :param reader_key: cache_key of the importer that reads the file, if any.
+    """
+    stat = os.stat(results_file_name)
+    sha1 = hashlib.sha1()
+    with open(results_file_name, 'rb') as f:
+        sha1.update(f.read(HASH_BLOCK_SIZE))
+        if stat.st_size > HASH_BLOCK_SIZE:
+            f.seek(max(HASH_BLOCK_SIZE, stat.st_size - HASH_BLOCK_SIZE))
+            sha1.update(f.read())
+    return {
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'hash': sha1.hexdigest(),
+        'run_time': run_time,
+        'byteorder': sys.byteorder,
+        'reader': reader_key,
+    }
+
+
+
+def _dump_names(names):
+    """names as json values: [type, text], byte strings decoded as latin-1."""
+    return [isinstance(name, unicode) and ['u', name] or ['s', name.decode('latin-1')] for name in names]
+
+
+
+def _load_names(names):
+    return [kind == 'u' and text or text.encode('latin-1') for kind, text in names]
+
+
+
+def save(file_name, source, columns, totals):
+    """
+    write a cache of ResultColumns.
+    :param source: source_info() of the results file.
+    :param totals: dict of the Results attributes that are not columns:
+                   numbers, or sets of names (loaded as lists).
+    """
+    layout = []
+    offset = 0
+    for name in COLUMNS:
+        column = getattr(columns, name)
+        size = len(column) * column.itemsize
+        layout.append((name, column.typecode, column.itemsize, offset, size))
+        offset += size + (-size % 8)
+    header = json.dumps({
+        'source': source,
+        'totals': dict((key, isinstance(value, (set, list)) and {'names': _dump_names(value)} or value)
+                       for key, value in totals.iteritems()),
+        'group_names': _dump_names(columns.group_names),
+        'errors': _dump_names(columns.errors),
+        'timer_names': _dump_names(columns.timer_names),
+        'layout': layout,
+    }, separators=(',', ':'))
+    header += '\0' * (-(len(MAGIC) + HEADER_SIZE.size + len(header)) % 8)
+
+    temp_file_name = file_name + '.tmp'
+    with open(temp_file_name, 'wb') as f:
+        f.write(MAGIC)
+        f.write(HEADER_SIZE.pack(len(header)))
+        f.write(header)
+        for name, typecode, itemsize, offset, size in layout:
+            getattr(columns, name).tofile(f)
+            f.write('\0' * (-size % 8))
+    if os.path.exists(file_name):  # os.rename does not replace files on windows
+        os.remove(file_name)
+    os.rename(temp_file_name, file_name)
+
+
+
+def load(file_name, source, columns):
+    """
+    fill an empty ResultColumns from a cache file.
+    :returns: the totals given to save(), or None if there is no valid cache.
+    """
+    if not os.path.exists(file_name):
+        return None
+    with open(file_name, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            return None
+        header_size, = HEADER_SIZE.unpack(f.read(HEADER_SIZE.size))
+        header = json.loads(f.read(header_size).rstrip('\0'))
+        if header['source'] != source:
+            return None
+        for name, typecode, itemsize, offset, size in header['layout']:
+            column = getattr(columns, str(name))
+            if column.typecode != typecode or column.itemsize != itemsize:
+                return None
+        data_offset = len(MAGIC) + HEADER_SIZE.size + header_size
+        for name, typecode, itemsize, offset, size in header['layout']:
+            # read straight into the column array
+            column = getattr(columns, str(name))
+            del column[:]
+            f.seek(data_offset + offset)
+            try:
+                column.fromfile(f, size // itemsize)
+            except EOFError:  # truncated cache file
+                return None
+    columns.group_names[:] = _load_names(header['group_names'])
+    columns.errors[:] = _load_names(header['errors'])
+    columns.timer_names[:] = _load_names(header['timer_names'])
+    for kind, names in enumerate((columns.group_names, columns.errors, columns.timer_names)):
+        columns.ids[kind].clear()
+        columns.ids[kind].update((name, i) for i, name in enumerate(names))
+    totals = {}
+    for key, value in header['totals'].iteritems():
+        if isinstance(value, dict):
+            value = _load_names(value['names'])
+        totals[str(key)] = value
+    return totals
@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+#
+#  Copyright (c) 2010-2012 Corey Goldberg (corey@goldb.org)
+#  License: GNU LGPLv3
+#
+#  This file is part of Multi-Mechanize | Performance Test Framework
+#
+
+"""
+reading and writing results files.
+
+results are stored either in the legacy csv format (results.csv), one line
+per transaction with the custom timers as a python dict repr, or in a
+compact binary format (results.bin).
+
+binary format: the file starts with MAGIC, followed by a stream of entries.
+each entry starts with a one byte type:
+
+  'N'  name definition: kind (B, 0 = user group, 1 = custom timer), id (H),
+       length (H), then the name (utf-8 encoded if it was unicode).  names are defined before
+       the first record that uses them.
+  'R'  transaction record: request_num (Q), elapsed (d), epoch (q),
+       user group id (H), trans_time (d), start_ns (q), finish_ns (q),
+       error length (H), timer count (H), then the error string and
+       timer count times timer id (H) + value (d).  start_ns and finish_ns
+       are 0 when unknown.
+
+all numbers are little-endian.
+"""
+
+import ast
+import mmap
+import os
+import struct
+import sys
+
+
+RESULTS_CSV = 'results.csv'
+RESULTS_BINARY = 'results.bin'
+
+MAGIC = 'MMRB\x01'
+USER_GROUP = 0
+TIMER = 1
+
+NAME = struct.Struct('<cBHH')
+RECORD = struct.Struct('<cQdqHdqqHH')
+TIMER_VALUE = struct.Struct('<Hd')
+
+
+
+def results_file_name(results_dir):
+    """:returns: name of the results file in a results directory (csv preferred)."""
+    for file_name in (RESULTS_CSV, RESULTS_BINARY):
+        if os.path.exists(os.path.join(results_dir, file_name)):
+            return file_name
+    return RESULTS_CSV
+
+
+
+class CsvEncoder(object):
+    """encodes result records as legacy results.csv lines."""
+
+    def header(self):
+        return ''
+
+    def encode(self, request_num, elapsed, epoch, user_group_name, trans_time, error, custom_timers, start_ns, finish_ns):
+        if start_ns is None:  # converted from a file written without stamps
+            return '%i,%.3f,%i,%s,%f,%s,%s\n' % (request_num, elapsed, epoch, user_group_name, trans_time, error, repr(custom_timers))
+        return '%i,%.3f,%i,%s,%f,%s,%s,%i,%i\n' % (request_num, elapsed, epoch, user_group_name, trans_time, error, repr(custom_timers), start_ns, finish_ns)
+
+
+
+class BinaryEncoder(object):
+    """
+    encodes result records as binary entries.  user group and timer names
+    are interned to small integer ids; the definition of a new name is
+    emitted in front of the first record using it.
+    """
+
+    def __init__(self):
+        self.ids = ({}, {})  # user group ids, timer ids
+
+    def header(self):
+        return MAGIC
+
+    def name_id(self, kind, name, entries):
+        ids = self.ids[kind]
+        name_id = ids.get(name)
+        if name_id is None:
+            name_id = ids[name] = len(ids)
+            encoded = _encode(name)
+            entries.append(NAME.pack('N', kind, name_id, len(encoded)))
+            entries.append(encoded)
+        return name_id
+
+    def encode(self, request_num, elapsed, epoch, user_group_name, trans_time, error, custom_timers, start_ns, finish_ns):
+        entries = []
+        group_id = self.name_id(USER_GROUP, user_group_name, entries)
+        error = _encode(error)[:0xffff]
+        timers = [TIMER_VALUE.pack(self.name_id(TIMER, name, entries), float(value))
+                  for name, value in custom_timers.iteritems()]
+        entries.append(RECORD.pack('R', request_num, elapsed, epoch, group_id, trans_time,
+                                   start_ns or 0, finish_ns or 0, len(error), len(timers)))
+        entries.append(error)
+        entries.extend(timers)
+        return ''.join(entries)
+
+
+
+def _encode(text):
+    if isinstance(text, unicode):
+        return text.encode('utf-8')
+    return text
+
+
+
+def parse_csv_line(line):
+    """
+    parse one line of a results.csv file.
+    :returns: (request_num, elapsed, epoch, user_group_name, trans_time,
+               error, custom_timers, start_ns, finish_ns)
+    """
+    line = line.strip()
+    # the custom timers dict may be followed by the start and finish
+    # stamps (nanoseconds since the epoch) of the transaction
+    timers_end = line.rfind('}') + 1
+    stamps = line[timers_end + 1:]
+    fields = line[:timers_end].split(',')
+
+    request_num = int(fields[0])
+    elapsed_time = float(fields[1])
+    epoch_secs = int(fields[2])
+    user_group_name = fields[3]
+    trans_time = float(fields[4])
+    error = fields[5]
+    start_ns = finish_ns = None
+    if stamps:
+        start_ns, finish_ns = [int(stamp) for stamp in stamps.split(',')]
+
+    custom_timers = {}
+    timers_string = ''.join(fields[6:]).replace('{', '').replace('}', '')
+    if '"' in timers_string or '\\' in timers_string or len(fields) - 6 != max(timers_string.count(':'), 1):
+        # timer names with quotes or commas need the slow path
+        return (request_num, elapsed_time, epoch_secs, user_group_name, trans_time, error,
+                ast.literal_eval(','.join(fields[6:])), start_ns, finish_ns)
+    splat = timers_string.split("'")[1:]
+    timers = []
+    vals = []
+    for x in splat:
+        if ':' in x:
+            x = float(x.replace(': ', ''))
+            vals.append(x)
+        else:
+            timers.append(x)
+    for timer, val in zip(timers, vals):
+        custom_timers[timer] = val
+
+    return request_num, elapsed_time, epoch_secs, user_group_name, trans_time, error, custom_timers, start_ns, finish_ns
+
+
+
+def read_csv(file_name):
+    """yields the records of a results.csv file."""
+    with open(file_name, 'rb') as f:
+        for line in f:
+            yield parse_csv_line(line)
+
+
+
+def split_csv(file_name, parts):
+    """
+    split a results.csv file into byte ranges of about equal size.
+    :returns: [(start, end)], every range starting at the beginning of a line.
+    """
+    size = os.path.getsize(file_name)
+    bounds = [0]
+    with open(file_name, 'rb') as f:
+        for i in xrange(1, parts):
+            offset = size * i // parts
+            if offset <= bounds[-1]:
+                continue
+            f.seek(offset - 1)
+            f.readline()  # move to the start of the next line
+            position = f.tell()
+            if bounds[-1] < position < size:
+                bounds.append(position)
+    bounds.append(size)
+    return zip(bounds, bounds[1:])
+
+
+
+def read_csv_range(file_name, start, end):
+    """yields the records of the lines of a results.csv file that start within [start, end)."""
+    with open(file_name, 'rb') as f:
+        f.seek(start)
+        position = start
+        while position < end:
+            line = f.readline()
+            if not line:
+                break
+            position += len(line)
+            yield parse_csv_line(line)
+
+
+
+def read_binary(file_name):
+    """yields the records of a binary results file, up to an incomplete entry at its end."""
+    with open(file_name, 'rb') as f:
+        if os.fstat(f.fileno()).st_size <= len(MAGIC):
+            return
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if data[:len(MAGIC)] != MAGIC:
+                raise ValueError('%s is not a binary results file' % file_name)
+            names = ({}, {})  # user group names, timer names
+            offset = len(MAGIC)
+            size = len(data)
+            while offset < size:
+                if data[offset] == 'N':
+                    if offset + NAME.size > size:
+                        break
+                    entry_type, kind, name_id, length = NAME.unpack_from(data, offset)
+                    if offset + NAME.size + length > size:
+                        break
+                    offset += NAME.size
+                    names[kind][name_id] = data[offset:offset + length]
+                    offset += length
+                    continue
+                if offset + RECORD.size > size:
+                    break
+                (entry_type, request_num, elapsed, epoch, group_id, trans_time,
+                 start_ns, finish_ns, error_length, timer_count) = RECORD.unpack_from(data, offset)
+                if offset + RECORD.size + error_length + timer_count * TIMER_VALUE.size > size:
+                    break
+                offset += RECORD.size
+                error = data[offset:offset + error_length]
+                offset += error_length
+                custom_timers = {}
+                timer_names = names[TIMER]
+                for i in xrange(timer_count):
+                    timer_id, value = TIMER_VALUE.unpack_from(data, offset)
+                    offset += TIMER_VALUE.size
+                    custom_timers[timer_names[timer_id]] = value
+                yield (request_num, elapsed, epoch, names[USER_GROUP][group_id], trans_time, error,
+                       custom_timers, start_ns or None, finish_ns or None)
+            if offset < size:
+                # the run was killed while the last entry was written
+                sys.stderr.write('\nWARNING: %s ends with an incomplete entry (%d bytes), ignored\n\n' %
+                                 (file_name, size - offset))
+        finally:
+            data.close()
+
+
+
+def is_binary(file_name):
+    with open(file_name, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+
+def read_results(file_name):
+    """yields the records of a results file in either format."""
+    if is_binary(file_name):
+        return read_binary(file_name)
+    return read_csv(file_name)
+
+
+
+def csv_to_binary(csv_file_name, binary_file_name):
+    encoder = BinaryEncoder()
+    with open(binary_file_name, 'wb') as f:
+        f.write(encoder.header())
+        for record in read_csv(csv_file_name):
+            f.write(encoder.encode(*record))
+
+
+
+def binary_to_csv(binary_file_name, csv_file_name):
+    encoder = CsvEncoder()
+    with open(csv_file_name, 'wb') as f:
+        for record in read_binary(binary_file_name):
+            f.write(encoder.encode(*record))
@@ -8,22 +8,27 @@
 
 """a collection of functions and classes for multi-mechanize results files"""
 
-import re
-import fileinput
+import time
 from datetime import datetime
 
+import multimechanize.resultsfile as resultsfile
+
 try:
     from sqlalchemy.ext.declarative import declarative_base
     from sqlalchemy.orm import sessionmaker, relation
     from sqlalchemy import create_engine
     from sqlalchemy import Column, Integer, String, Float, DateTime
     from sqlalchemy import ForeignKey, UniqueConstraint
+    from sqlalchemy import select
 except ImportError:
     print "(optional: please install sqlalchemy to enable db logging)"
 
 
 Base = declarative_base()
 
+# results inserted per transaction by load_results_database()
+BATCH_SIZE = 10000
+
 class GlobalConfig(Base):
     """class representing a muli-mechanize global config"""
     __tablename__ = 'mechanize_global_configs'
@@ -70,7 +75,7 @@ class ResultRow(Base):
     """class representing a multi-mechanize results.csv row"""
     __tablename__ = 'mechanize_results'
     __table_args__ = (
-        UniqueConstraint('run_id','trans_count', name='uix_1')
+        UniqueConstraint('run_id','trans_count', name='uix_1'),
         )
 
     id = Column(Integer, nullable=False, primary_key=True)
@@ -133,9 +138,7 @@ class TimerRow(Base):
 def load_results_database(project_name, run_localtime, results_dir,
         results_database, run_time, rampup, results_ts_interval,
         user_group_configs):
-    """parse and load a multi-mechanize results csv file into a database"""
-
-    logline_re = re.compile('(.+),(.+),(.+),(.+),(.+),(.?),(\{.+\})')
+    """parse and load a multi-mechanize results file into a database"""
 
     engine = create_engine(results_database, echo=False)
     ResultRow.metadata.create_all(engine)
@@ -150,7 +153,7 @@ def load_results_database(project_name, run_localtime, results_dir,
         run_localtime.tm_mday, run_localtime.tm_hour, run_localtime.tm_min,
         run_localtime.tm_sec)
 
-    results_file = results_dir + 'results.csv'
+    results_file = results_dir + resultsfile.results_file_name(results_dir)
 
     global_config = GlobalConfig(run_time, rampup, results_ts_interval)
     sa_current_session.add(global_config)
@@ -160,21 +163,89 @@ def load_results_database(project_name, run_localtime, results_dir,
                 ug_config.num_threads, ug_config.script_file)
         global_config.user_group_configs.append(user_group_config)
 
-    for line in fileinput.input([results_file]):
-        line = line.rstrip()
-        match = logline_re.match(line)
-        if match:
-            result_row = ResultRow(project_name, run_id, match.group(1),
-                    match.group(2), match.group(3), match.group(4),
-                    match.group(5), match.group(6), match.group(7))
-
-            global_config.results.append(result_row)
-            timer_data = eval(match.group(7))
-            for index in timer_data:
-                timer_row = TimerRow(index, timer_data[index])
-                result_row.timers.append(timer_row)
-
-            sa_current_session.add(result_row)
-
     sa_current_session.commit()
+    global_config_id = global_config.id
     sa_current_session.close()
+
+    start_time = time.time()
+    result_count, timer_count = load_result_rows(engine, global_config_id,
+            project_name, run_id, resultsfile.read_results(results_file))
+    load_time = time.time() - start_time
+    print 'loaded %i results and %i custom timers in %.1f secs (%i rows/sec)\n' % (
+            result_count, timer_count, load_time,
+            (result_count + timer_count) / max(load_time, 0.001))
+
+
+def load_result_rows(engine, global_config_id, project_name, run_id, records,
+        batch_size=BATCH_SIZE):
+    """
+    insert result records and their custom timers with executemany, in
+    transactions of batch_size results.  the database assigns the result
+    ids; the timer rows of a batch are inserted once the ids of its results
+    are looked up by their unique (run_id, trans_count).
+    :returns: (number of results, number of custom timers) inserted
+    """
+    result_count = timer_count = 0
+    connection = engine.connect()
+    try:
+        result_rows = []
+        timers = []  # (trans_count, timer_name, value)
+        for (trans_count, elapsed, epoch, user_group_name, scriptrun_time, error,
+                timer_data, start_ns, finish_ns) in records:
+            # same values the ResultRow and TimerRow constructors store
+            result_rows.append({
+                'mechanize_global_configs_id': global_config_id,
+                'project_name': str(project_name),
+                'run_id': run_id,
+                'trans_count': int(trans_count),
+                'elapsed': float(elapsed),
+                'epoch': int(epoch),
+                'user_group_name': str(user_group_name),
+                'scriptrun_time': float(scriptrun_time),
+                'error': str(error),
+                'custom_timers': repr(timer_data),
+            })
+            for index in timer_data:
+                timers.append((int(trans_count), str(index), int(timer_data[index])))
+            if len(result_rows) >= batch_size:
+                timer_count += insert_batch(connection, run_id, result_rows, timers)
+                result_count += len(result_rows)
+                result_rows = []
+                timers = []
+        if result_rows:
+            timer_count += insert_batch(connection, run_id, result_rows, timers)
+            result_count += len(result_rows)
+    finally:
+        connection.close()
+    return result_count, timer_count
+
+
+def insert_batch(connection, run_id, result_rows, timers):
+    """insert a batch of results and their timers in one transaction; :returns: number of timers"""
+    results_table = ResultRow.__table__
+    timers_table = TimerRow.__table__
+    transaction = connection.begin()
+    try:
+        connection.execute(results_table.insert(), result_rows)
+        timer_rows = []
+        if timers:
+            trans_counts = [row['trans_count'] for row in result_rows]
+            batch_trans_counts = set(trans_counts)
+            result_ids = {}
+            query = select([results_table.c.trans_count, results_table.c.id]).where(
+                    (results_table.c.run_id == run_id) &
+                    results_table.c.trans_count.between(min(trans_counts), max(trans_counts)))
+            for trans_count, result_id in connection.execute(query):
+                if trans_count in batch_trans_counts:
+                    result_ids[trans_count] = result_id
+            timer_rows = [{
+                'mechanize_results_id': result_ids[trans_count],
+                'timer_name': timer_name,
+                'elapsed': value,
+            } for trans_count, timer_name, value in timers]
+            connection.execute(timers_table.insert(), timer_rows)
+        transaction.commit()
+    except:
+        transaction.rollback()
+        raise
+    return len(timer_rows)
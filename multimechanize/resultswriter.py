@@ -9,20 +9,37 @@
 
 import os
 import Queue
+import sys
 import threading
 import time
 
+from multimechanize.histogram import HISTOGRAMS_FILE
+from multimechanize.resultsfile import RESULTS_BINARY, RESULTS_CSV, BinaryEncoder, CsvEncoder
+
 
 
 class ResultsWriter(threading.Thread):
-    def __init__(self, queue, output_dir, console_logging):
+    def __init__(self, queue, output_dir, console_logging, flush_interval=1.0, buffer_size=1048576,
+                 histograms=None, results_format='csv'):
         threading.Thread.__init__(self)
         self.queue = queue
         self.console_logging = console_logging
         self.output_dir = output_dir
+        self.flush_interval = flush_interval
+        self.buffer_size = buffer_size
+        self.histograms = histograms
+        if results_format == 'binary':
+            self.results_file = RESULTS_BINARY
+            self.encoder = BinaryEncoder()
+        else:
+            self.results_file = RESULTS_CSV
+            self.encoder = CsvEncoder()
         self.trans_count = 0
         self.timer_count = 0
         self.error_count = 0
+        self.busy_time = 0.0
+        self.start_time = None
+        self.stop_time = None
 
         try:
             os.makedirs(self.output_dir, 0755)
@@ -30,18 +47,69 @@ class ResultsWriter(threading.Thread):
             sys.stderr.write('ERROR: Can not create output directory\n')
             sys.exit(1)
 
+    def stop(self):
+        """ask the writer to finish once everything queued so far is written."""
+        self.queue.put(None)
+
     def run(self):
-        with open(self.output_dir + 'results.csv', 'w') as f:
-            while True:
+        self.start_time = time.time()
+        encode = self.encoder.encode
+        with open(self.output_dir + self.results_file, 'wb', self.buffer_size) as f:
+            f.write(self.encoder.header())
+            last_flush = time.time()
+            stopped = False
+            while not stopped:
                 try:
-                    elapsed, epoch, self.user_group_name, scriptrun_time, error, custom_timers = self.queue.get(False)
-                    self.trans_count += 1
-                    self.timer_count += len(custom_timers)
-                    if error != '':
-                        self.error_count += 1
-                    f.write('%i,%.3f,%i,%s,%f,%s,%s\n' % (self.trans_count, elapsed, epoch, self.user_group_name, scriptrun_time, error, repr(custom_timers)))
-                    f.flush()
-                    if self.console_logging:
-                        print '%i, %.3f, %i, %s, %.3f, %s, %s' % (self.trans_count, elapsed, epoch, self.user_group_name, scriptrun_time, error, repr(custom_timers))
+                    batches = [self.queue.get(True, self.flush_interval)]
                 except Queue.Empty:
-                    time.sleep(.05)
+                    batches = []
+                # drain everything that arrived in the meantime in one pass
+                while True:
+                    try:
+                        batches.append(self.queue.get(False))
+                    except Queue.Empty:
+                        break
+                busy_start = time.time()
+                lines = []
+                for batch in batches:
+                    if batch is None:  # stop() was called
+                        stopped = True
+                        continue
+                    for elapsed, epoch, user_group_name, scriptrun_time, error, custom_timers, start_ns, finish_ns in batch:
+                        self.trans_count += 1
+                        self.timer_count += len(custom_timers)
+                        if error != '':
+                            self.error_count += 1
+                        # results files keep elapsed times to the millisecond
+                        elapsed = round(elapsed, 3)
+                        lines.append(encode(self.trans_count, elapsed, epoch, user_group_name, scriptrun_time, error, custom_timers, start_ns, finish_ns))
+                        if self.histograms is not None:
+                            self.histograms.record(elapsed, epoch, user_group_name, scriptrun_time, error, custom_timers)
+                        if self.console_logging:
+                            print '%i, %.3f, %i, %s, %.3f, %s, %s' % (self.trans_count, elapsed, epoch, user_group_name, scriptrun_time, error, repr(custom_timers))
+                if lines:
+                    f.write(''.join(lines))
+                now = time.time()
+                if now - last_flush >= self.flush_interval:
+                    f.flush()
+                    last_flush = now
+                self.busy_time += now - busy_start
+        if self.histograms is not None:
+            self.histograms.save(self.output_dir + HISTOGRAMS_FILE)
+        self.stop_time = time.time()
+
+    def write_rate(self):
+        """
+        sustained write rate of the writer.
+        :returns: (records per second of busy time, fraction of wall time busy)
+        """
+        wall_time = (self.stop_time or time.time()) - (self.start_time or time.time())
+        if self.busy_time > 0:
+            rate = self.trans_count / self.busy_time
+        else:
+            rate = 0.0
+        if wall_time > 0:
+            load = self.busy_time / wall_time
+        else:
+            load = 0.0
+        return rate, load
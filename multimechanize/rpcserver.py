@@ -11,6 +11,8 @@ import SimpleXMLRPCServer
 import socket
 import thread
 
+import multimechanize.resultsfile as resultsfile
+
 
 
 def launch_rpc_server(bind_addr, port, project_name, run_callback):
@@ -58,6 +60,11 @@ class RemoteControl(object):
     def get_results(self):
         if self.output_dir is None:
             return 'Results Not Available'
-        else:
-            with open(self.output_dir + 'results.csv', 'r') as f:
+        results_file = resultsfile.results_file_name(self.output_dir)
+        if results_file == resultsfile.RESULTS_CSV:
+            with open(self.output_dir + results_file, 'r') as f:
                 return f.read()
+        # always hand out the csv format
+        encoder = resultsfile.CsvEncoder()
+        return ''.join([encoder.encode(*record) for record in
+                        resultsfile.read_binary(self.output_dir + results_file)])
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+#
+#  Copyright (c) 2010-2012 Corey Goldberg (corey@goldb.org)
+#  License: GNU LGPLv3
+#
+#  This file is part of Multi-Mechanize | Performance Test Framework
+#
+
+
+import os
+import sys
+
+try:
+    # installed
+    import multimechanize
+except ImportError:
+    # from dev/source
+    this_dir = os.path.abspath(os.path.dirname(__file__))
+    sys.path.append(os.path.join(this_dir, '../../'))
+    import multimechanize
+
+import multimechanize.resultsfile as resultsfile
+
+
+USAGE = 'Usage: multimech-convert-results <results file> <output file>\n'
+
+
+def convert(input_file, output_file):
+    """convert a results file from csv to binary or from binary to csv."""
+    with open(input_file, 'rb') as f:
+        binary = f.read(len(resultsfile.MAGIC)) == resultsfile.MAGIC
+    if binary:
+        resultsfile.binary_to_csv(input_file, output_file)
+    else:
+        resultsfile.csv_to_binary(input_file, output_file)
+
+
+def main():
+    try:
+        input_file, output_file = sys.argv[1:3]
+    except ValueError:
+        sys.stderr.write('\nERROR: input and output file required\n\n')
+        sys.stderr.write(USAGE)
+        sys.stderr.write('Example: multimech-convert-results results.csv results.bin\n\n')
+        sys.exit(1)
+    if not os.path.exists(input_file):
+        sys.stderr.write('\nERROR: can not find results file: %s\n\n' % input_file)
+        sys.exit(1)
+
+    convert(input_file, output_file)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+#
+#  Copyright (c) 2010-2012 Corey Goldberg (corey@goldb.org)
+#  License: GNU LGPLv3
+#
+#  This file is part of Multi-Mechanize | Performance Test Framework
+#
+
+
+import optparse
+import os
+import sys
+
+try:
+    # installed
+    import multimechanize
+except ImportError:
+    # from dev/source
+    this_dir = os.path.abspath(os.path.dirname(__file__))
+    sys.path.append(os.path.join(this_dir, '../../'))
+    import multimechanize
+
+import multimechanize.importers as importers
+import multimechanize.results as results
+
+
+USAGE = 'Usage: multimech-import-results <results file> <output directory> [options]'
+
+
+def get_reader(input_file, opts):
+    format = opts.format or importers.detect_format(input_file)
+    if format is None:
+        raise ValueError('can not tell the format of %s, use --format' % input_file)
+    if format != 'csv':
+        return importers.get_reader(format)
+    columns = {}
+    for mapping in opts.columns or []:
+        field, sep, column = mapping.partition('=')
+        if not sep:
+            raise ValueError('column mapping %s is not <field>=<column>' % mapping)
+        columns[field.strip()] = column.strip()
+    return importers.get_reader('csv', columns, opts.timestamp_unit, opts.time_unit, not opts.no_header,
+                                opts.delimiter)
+
+
+def main():
+    parser = optparse.OptionParser(usage=USAGE, version=multimechanize.__version__)
+    parser.add_option('-f', '--format', dest='format', choices=sorted(importers.READERS),
+                      help='format of the results file: %s (default: guessed)' % ', '.join(sorted(importers.READERS)))
+    parser.add_option('-c', '--column', dest='columns', action='append', metavar='FIELD=COLUMN',
+                      help='csv column mapping, e.g. -c timestamp=start -c time=duration -c label=name')
+    parser.add_option('--timestamp-unit', dest='timestamp_unit', default='ms', help='unit of csv timestamps (default: ms)')
+    parser.add_option('--time-unit', dest='time_unit', default='ms', help='unit of csv durations (default: ms)')
+    parser.add_option('--no-header', dest='no_header', action='store_true', default=False,
+                      help='the csv file has no header; columns are mapped by 0-based index')
+    parser.add_option('--delimiter', dest='delimiter', default=',', help='csv delimiter (default: ,)')
+    parser.add_option('-i', '--interval', dest='interval', type='int', default=10, help='time-series interval in secs (default: 10)')
+    parser.add_option('-t', '--run-time', dest='run_time', type='int', help='analyze only the first secs of the results (default: all)')
+    parser.add_option('-s', '--streaming', dest='streaming', action='store_true', default=False,
+                      help='analyze out of core, with histograms and samples of the raw points')
+    parser.add_option('--sample-size', dest='sample_size', type='int', default=10000, help='raw points kept per graph with --streaming')
+    parser.add_option('--graphs', dest='graphs', choices=['png', 'interactive'], default='png', help='png or interactive report graphs')
+    parser.add_option('--cache', dest='cache', action='store_true', default=False, help='cache the parsed results in <results file>.cache')
+    parser.add_option('--xml', dest='xml', action='store_true', default=False, help='also write the results as JMeter XML (results.jtl)')
+    cmd_opts, args = parser.parse_args()
+
+    try:
+        input_file, output_dir = args[:2]
+    except ValueError:
+        sys.stderr.write('\nERROR: results file and output directory required\n\n')
+        sys.stderr.write(USAGE + '\n')
+        sys.stderr.write('Example: multimech-import-results jmeter.jtl jmeter_report\n\n')
+        sys.exit(1)
+    if not os.path.exists(input_file):
+        sys.stderr.write('\nERROR: can not find results file: %s\n\n' % input_file)
+        sys.exit(1)
+
+    try:
+        reader = get_reader(input_file, cmd_opts)
+    except ValueError, e:
+        sys.stderr.write('\nERROR: %s\n\n' % e)
+        sys.exit(1)
+
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    output_dir = os.path.join(output_dir, '')
+    print '\n\nanalyzing results...\n'
+    results.output_results(output_dir, os.path.abspath(input_file), cmd_opts.run_time, 0, cmd_opts.interval,
+                           xml_reports=cmd_opts.xml, streaming=cmd_opts.streaming, sample_size=cmd_opts.sample_size,
+                           cache=cmd_opts.cache, report_graphs=cmd_opts.graphs, reader=reader)
+    print 'created: %sresults.html\n' % output_dir
+
+
+if __name__ == '__main__':
+    main()
@@ -31,11 +31,17 @@ except ImportError:
     import multimechanize
 
 import multimechanize.core as core
+import multimechanize.feeder as feeder
+import multimechanize.histogram as histogram
 import multimechanize.results as results
+import multimechanize.resultsfile as resultsfile
 import multimechanize.resultswriter as resultswriter
 import multimechanize.progressbar as progressbar
 from multimechanize import __version__ as VERSION
 
+# virtual users per process when a user group is split with processes = auto
+THREADS_PER_PROCESS = {'thread': 50, 'greenlet': 1000}
+
 def main():
     """
     Main function to run multimechanize benchmark/performance test.
@@ -71,7 +77,7 @@ def main():
     except Exception, e:
         parser.error(e)
 
-def setup_generators ( projects_dir, project_name, generator_scripts ):
+def setup_generators ( projects_dir, project_name, generator_scripts, generator_options ):
     """
     loads / validates all generators specified by the config file.
     """
@@ -79,7 +85,27 @@ def setup_generators ( projects_dir, project_name, generator_scripts ):
     try:
         for generator in generator_scripts:
             script = generator_scripts[generator]
-            generators[generator] = core.GeneratorWrapper(os.path.join(projects_dir, project_name, "generators", script))
+            options = generator_options.get(generator, {})
+            batch_size = int(options.get('batch_size', 1))
+            cache_size = int(options.get('cache_size', 0))
+            cache_ttl = options.get('cache_ttl')
+            if cache_ttl is not None:
+                cache_ttl = float(cache_ttl)
+            if 'feeder' in options:
+                generators[generator] = feeder.DataFeeder(os.path.join(projects_dir, project_name, "generators", script),
+                                                          options['feeder'], options.get('format', 'lines'),
+                                                          options.get('header', 'off').lower() in ('1', 'yes', 'true', 'on'))
+                continue
+            threads = options.get('threads')
+            if threads is not None:
+                threads = int(threads)
+            shards = int(options.get('shards', 1))
+            if shards > 1 or options.get('process', 'off').lower() in ('1', 'yes', 'true', 'on'):
+                generators[generator] = core.GeneratorService(os.path.join(projects_dir, project_name, "generators", script),
+                                                              batch_size, cache_size, cache_ttl, threads, shards)
+            else:
+                generators[generator] = core.GeneratorWrapper(os.path.join(projects_dir, project_name, "generators", script),
+                                                              batch_size, cache_size, cache_ttl)
             generators[generator].start()
             atexit.register(generators[generator].terminate)
         return generators
@@ -93,7 +119,7 @@ def run_test(project_name, cmd_opts, remote_starter=None):
         remote_starter.test_running = True
         remote_starter.output_dir = None
 
-    run_time, rampup, results_ts_interval, console_logging, progress_bar, results_database, pre_run_script, post_run_script, xml_report, user_group_configs, generator_scripts = configure(project_name, cmd_opts)
+    run_time, rampup, results_ts_interval, console_logging, progress_bar, results_database, pre_run_script, post_run_script, xml_report, user_group_configs, generator_scripts, generator_options, results_batch_size, results_batch_interval, results_flush_interval, results_buffer_size, histogram_precision, results_format, streaming_analysis, analysis_sample_size, analysis_processes, results_cache, report_graphs = configure(project_name, cmd_opts)
 
     # Run setup script
     if pre_run_script is not None:
@@ -105,24 +131,42 @@ def run_test(project_name, cmd_opts, remote_starter=None):
     run_localtime = time.localtime()
     output_dir = '%s/%s/results/results_%s' % (cmd_opts.projects_dir, project_name, time.strftime('%Y.%m.%d_%H.%M.%S/', run_localtime))
 
-    generators = setup_generators ( cmd_opts.projects_dir, project_name, generator_scripts )
+    generators = setup_generators ( cmd_opts.projects_dir, project_name, generator_scripts, generator_options )
     # this queue is shared between all processes/threads
     queue = multiprocessing.Queue()
-    rw = resultswriter.ResultsWriter(queue, output_dir, console_logging)
+    histograms = histogram.ResultsHistograms(run_time, results_ts_interval, histogram_precision)
+    rw = resultswriter.ResultsWriter(queue, output_dir, console_logging,
+                                     results_flush_interval, results_buffer_size, histograms, results_format)
     rw.daemon = True
     rw.start()
     script_prefix = os.path.join(cmd_opts.projects_dir, project_name, "test_scripts")
     script_prefix = os.path.normpath(script_prefix)
 
+    for ug_config in user_group_configs:
+        if ug_config.generator and hasattr(generators.get(ug_config.generator), 'add_consumers'):
+            generators[ug_config.generator].add_consumers(ug_config.name, ug_config.num_threads)
+
     user_groups = []
-    for i, ug_config in enumerate(user_group_configs):
+    process_num = 0
+    for ug_config in user_group_configs:
         script_file = os.path.join(script_prefix, ug_config.script_file)
         gen_cli = None
         if ug_config.generator:
             gen_cli = generators[ug_config.generator].get_client()
-        ug = core.UserGroup(queue, i, ug_config.name, ug_config.num_threads,
-                            script_file, run_time, rampup, gen_cli, ug_config.user_group_global_config)
-        user_groups.append(ug)
+        # large user groups are split into several processes.  every process
+        # gets its own process_num and continues the group's thread_num count.
+        thread_offset = 0
+        for num_threads, rate, arrival_offset in split_user_group(ug_config):
+            cpu = None
+            if ug_config.cpu_affinity:
+                cpu = process_num % multiprocessing.cpu_count()
+            ug = core.UserGroup(queue, process_num, ug_config.name, num_threads,
+                                script_file, run_time, rampup, gen_cli, ug_config.user_group_global_config,
+                                results_batch_size, results_batch_interval, ug_config.agent_type,
+                                rate, ug_config.arrival, thread_offset, cpu, arrival_offset)
+            user_groups.append(ug)
+            process_num += 1
+            thread_offset += num_threads
     for user_group in user_groups:
         user_group.start()
         atexit.register(user_group.terminate)
@@ -133,8 +177,9 @@ def run_test(project_name, cmd_opts, remote_starter=None):
         for user_group in user_groups:
             user_group.join()
     else:
-        print '\n  user_groups:  %i' % len(user_groups)
-        print '  threads: %i\n' % (ug_config.num_threads * len(user_groups))
+        print '\n  user_groups:  %i' % len(user_group_configs)
+        print '  processes: %i' % len(user_groups)
+        print '  threads: %i\n' % sum([ug_config.num_threads for ug_config in user_group_configs])
 
         if progress_bar:
             p = progressbar.ProgressBar(run_time)
@@ -163,10 +208,34 @@ def run_test(project_name, cmd_opts, remote_starter=None):
         if not sys.platform.startswith('win'):
             print
 
+    for ug_config in user_group_configs:
+        if ug_config.rate:
+            scheduled = late = missed = 0
+            for user_group in user_groups:
+                if user_group.user_group_name == ug_config.name:
+                    scheduled += user_group.scheduled_count.value
+                    late += user_group.late_count.value + user_group.missed_count.value
+                    missed += user_group.missed_count.value
+            print '\n%s: %i of %i scheduled transactions missed their start time (%.1f%%), %i never started' % (
+                ug_config.name, late, scheduled, 100.0 * late / max(scheduled, 1), missed)
+
+    for name in sorted(generators):
+        client = generators[name].get_client()
+        if getattr(client, 'cache', None) is not None:
+            hits, misses = client.cache_hits.value, client.cache_misses.value
+            print '\ngenerator %s: %i cache hits, %i misses (%.1f%% hit rate)' % (
+                name, hits, misses, 100.0 * hits / max(hits + misses, 1))
+
     # all agents are done running at this point
-    time.sleep(.2) # make sure the writer queue is flushed
-    print '\n\nanalyzing results...\n'
-    results.output_results(output_dir, 'results.csv', run_time, rampup, results_ts_interval, user_group_configs, xml_report)
+    rw.stop()
+    rw.join() # make sure the writer queue is flushed
+    write_rate, write_load = rw.write_rate()
+    print '\n\nresults writer: %i records, %.0f records/sec sustained, %.1f%% busy' % (
+        rw.trans_count, write_rate, write_load * 100)
+    print '\nanalyzing results...\n'
+    results.output_results(output_dir, rw.results_file, run_time, rampup, results_ts_interval, user_group_configs, xml_report,
+                           streaming_analysis, analysis_sample_size, histogram_precision, analysis_processes,
+                           results_cache, report_graphs)
     print 'created: %sresults.html\n' % output_dir
     if xml_report:
         print 'created: %sresults.jtl' % output_dir
@@ -198,13 +267,43 @@ def run_test(project_name, cmd_opts, remote_starter=None):
 
 
 
+def split_user_group(ug_config):
+    """
+    work out how the threads (and arrival rate) of a user group are spread
+    over its processes.  process i starts its schedule i / rate secs late,
+    so the fixed arrivals of the processes interleave instead of coinciding.
+    :returns: list of (num_threads, rate, arrival offset) tuples, one per process.
+    """
+    num_processes = ug_config.processes
+    if num_processes == 'auto':
+        per_process = THREADS_PER_PROCESS[ug_config.agent_type]
+        num_processes = min(multiprocessing.cpu_count(),
+                            (ug_config.num_threads + per_process - 1) // per_process)
+    num_processes = max(1, min(num_processes, ug_config.num_threads))
+    shards = []
+    for i in range(num_processes):
+        num_threads = ug_config.num_threads // num_processes
+        if i < ug_config.num_threads % num_processes:
+            num_threads += 1
+        rate = None
+        arrival_offset = 0.0
+        if ug_config.rate:
+            rate = ug_config.rate * num_threads / float(ug_config.num_threads)
+            arrival_offset = i / float(ug_config.rate)
+        shards.append((num_threads, rate, arrival_offset))
+    return shards
+
+
+
 def rerun_results(project_name, cmd_opts, results_dir):
     output_dir = '%s/%s/results/%s/' % (cmd_opts.projects_dir, project_name, results_dir)
     saved_config = '%s/config.cfg' % output_dir
     #run_time, rampup, results_ts_interval, console_logging, progress_bar, results_database, pre_run_script, post_run_script, xml_report, user_group_configs = configure(project_name, cmd_opts, config_file=saved_config)
-    run_time, rampup, results_ts_interval, console_logging, progress_bar, results_database, pre_run_script, post_run_script, xml_report, user_group_configs, generator_scripts = configure(project_name, cmd_opts, config_file=saved_config)
+    run_time, rampup, results_ts_interval, console_logging, progress_bar, results_database, pre_run_script, post_run_script, xml_report, user_group_configs, generator_scripts, generator_options, results_batch_size, results_batch_interval, results_flush_interval, results_buffer_size, histogram_precision, results_format, streaming_analysis, analysis_sample_size, analysis_processes, results_cache, report_graphs = configure(project_name, cmd_opts, config_file=saved_config)
     print '\n\nanalyzing results...\n'
-    results.output_results(output_dir, 'results.csv', run_time, rampup, results_ts_interval, user_group_configs, xml_report)
+    results.output_results(output_dir, resultsfile.results_file_name(output_dir), run_time, rampup, results_ts_interval, user_group_configs, xml_report,
+                           streaming_analysis, analysis_sample_size, histogram_precision, analysis_processes,
+                           results_cache, report_graphs)
     print 'created: %sresults.html\n' % output_dir
     if xml_report:
         print 'created: %sresults.jtl' % output_dir
@@ -215,6 +314,7 @@ def rerun_results(project_name, cmd_opts, results_dir):
 def configure(project_name, cmd_opts, config_file=None):
     user_group_configs = []
     generator_scripts = {}
+    generator_options = {}
     user_group_global_config = {}
     config = ConfigParser.ConfigParser()
     if config_file is None:
@@ -252,6 +352,58 @@ def configure(project_name, cmd_opts, config_file=None):
                 xml_report = config.getboolean(section, 'xml_report')
             except ConfigParser.NoOptionError:
                 xml_report = False
+            try:
+                results_batch_size = config.getint(section, 'results_batch_size')
+            except ConfigParser.NoOptionError:
+                results_batch_size = 100
+            try:
+                results_batch_interval = config.getint(section, 'results_batch_interval') / 1000.0
+            except ConfigParser.NoOptionError:
+                results_batch_interval = 0.5
+            try:
+                results_flush_interval = config.getint(section, 'results_flush_interval') / 1000.0
+            except ConfigParser.NoOptionError:
+                results_flush_interval = 1.0
+            try:
+                results_buffer_size = config.getint(section, 'results_buffer_size')
+            except ConfigParser.NoOptionError:
+                results_buffer_size = 1048576
+            try:
+                histogram_precision = config.getint(section, 'histogram_precision')
+            except ConfigParser.NoOptionError:
+                histogram_precision = 3
+            try:
+                results_format = config.get(section, 'results_format')
+                if results_format not in ('csv', 'binary'):
+                    raise AttributeError("unknown results_format %s (use csv or binary)" % results_format)
+            except ConfigParser.NoOptionError:
+                results_format = 'csv'
+            try:
+                streaming_analysis = config.getboolean(section, 'streaming_analysis')
+            except ConfigParser.NoOptionError:
+                streaming_analysis = False
+            try:
+                analysis_sample_size = config.getint(section, 'analysis_sample_size')
+            except ConfigParser.NoOptionError:
+                analysis_sample_size = 10000
+            try:
+                analysis_processes = config.get(section, 'analysis_processes')
+                if analysis_processes == 'auto':
+                    analysis_processes = multiprocessing.cpu_count()
+                else:
+                    analysis_processes = int(analysis_processes)
+            except ConfigParser.NoOptionError:
+                analysis_processes = multiprocessing.cpu_count()
+            try:
+                results_cache = config.getboolean(section, 'results_cache')
+            except ConfigParser.NoOptionError:
+                results_cache = True
+            try:
+                report_graphs = config.get(section, 'report_graphs')
+                if report_graphs not in ('png', 'interactive'):
+                    raise AttributeError("unknown report_graphs %s (use png or interactive)" % report_graphs)
+            except ConfigParser.NoOptionError:
+                report_graphs = 'png'
         elif section == "user_group_global":
             for option in config.options('user_group_global'):
                 option_val =  config.get(section, option)
@@ -259,10 +411,17 @@ def configure(project_name, cmd_opts, config_file=None):
         elif section == "generators":
             generators = config.options("generators")
             for gen in generators:
-                if generator_scripts.has_key(gen):
+                if '.' in gen:
+                    # <generator name>.<option> = <value>
+                    gen_name, option = gen.split('.', 1)
+                    generator_options.setdefault(gen_name, {})[option] = config.get("generators", gen)
+                elif generator_scripts.has_key(gen):
                     raise AttributeError("multiple configurations found for generator with name : %s" % gen)
                 else:
                     generator_scripts[gen] = config.get("generators", gen)
+            for gen_name in generator_options:
+                if not gen_name in generator_scripts:
+                    raise AttributeError("options found for undefined generator : %s" % gen_name)
 
         else:
             threads = config.getint(section, 'threads')
@@ -273,20 +432,58 @@ def configure(project_name, cmd_opts, config_file=None):
                 generator = config.get(section, 'generator')
                 if not generator in generator_scripts.keys():
                     raise AttributeError("generator %s required by user_group %s was not defined in the generators section" % ( generator, user_group_name))
-
-            ug_config = UserGroupConfig(threads, user_group_name, script, generator, user_group_global_config)
+            agent_type = 'thread'
+            if config.has_option(section, 'agent'):
+                agent_type = config.get(section, 'agent')
+                if agent_type not in ('thread', 'greenlet'):
+                    raise AttributeError("unknown agent type %s for user_group %s (use thread or greenlet)" % (agent_type, user_group_name))
+                if agent_type == 'greenlet':
+                    try:
+                        import gevent
+                    except ImportError:
+                        raise AttributeError("user_group %s uses greenlet agents, please install gevent" % user_group_name)
+            rate = None
+            if config.has_option(section, 'rate'):
+                rate = float(config.get(section, 'rate').replace('/s', ''))
+                if rate <= 0:
+                    raise AttributeError("rate for user_group %s must be greater than 0" % user_group_name)
+            arrival = 'fixed'
+            if config.has_option(section, 'arrival'):
+                arrival = config.get(section, 'arrival')
+                if arrival not in ('fixed', 'poisson'):
+                    raise AttributeError("unknown arrival schedule %s for user_group %s (use fixed or poisson)" % (arrival, user_group_name))
+
+            processes = 1
+            if config.has_option(section, 'processes'):
+                processes = config.get(section, 'processes')
+                if processes != 'auto':
+                    processes = int(processes)
+                    if processes < 1:
+                        raise AttributeError("processes for user_group %s must be auto or at least 1" % user_group_name)
+            cpu_affinity = False
+            if config.has_option(section, 'cpu_affinity'):
+                cpu_affinity = config.getboolean(section, 'cpu_affinity')
+
+            ug_config = UserGroupConfig(threads, user_group_name, script, generator, user_group_global_config, agent_type,
+                                        rate, arrival, processes, cpu_affinity)
             user_group_configs.append(ug_config)
-    return (run_time, rampup, results_ts_interval, console_logging, progress_bar, results_database, pre_run_script, post_run_script, xml_report, user_group_configs, generator_scripts)
+    return (run_time, rampup, results_ts_interval, console_logging, progress_bar, results_database, pre_run_script, post_run_script, xml_report, user_group_configs, generator_scripts, generator_options, results_batch_size, results_batch_interval, results_flush_interval, results_buffer_size, histogram_precision, results_format, streaming_analysis, analysis_sample_size, analysis_processes, results_cache, report_graphs)
 
 
 
 class UserGroupConfig(object):
-    def __init__(self, num_threads, name, script_file, generator, user_group_global_config):
+    def __init__(self, num_threads, name, script_file, generator, user_group_global_config, agent_type='thread',
+                 rate=None, arrival='fixed', processes=1, cpu_affinity=False):
         self.num_threads = num_threads
         self.name = name
         self.script_file = script_file
         self.generator = generator
         self.user_group_global_config = user_group_global_config
+        self.agent_type = agent_type
+        self.rate = rate
+        self.arrival = arrival
+        self.processes = processes
+        self.cpu_affinity = cpu_affinity
 
 
 if __name__ == '__main__':
@@ -47,6 +47,8 @@ CONSOLE_SCRIPTS = [
     'multimech-run = multimechanize.utilities.run:main',
     'multimech-newproject = multimechanize.utilities.newproject:main',
     'multimech-gridgui = multimechanize.utilities.gridgui:main',
+    'multimech-convert-results = multimechanize.utilities.convertresults:main',
+    'multimech-import-results = multimechanize.utilities.importresults:main',
 ]
 
 